@@ -0,0 +1,188 @@
+import json
+import time
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import praw
+
+# Time filters of reddit top listings and their length in seconds
+TIME_FILTERS: Dict[str, Optional[int]] = {
+    "hour": 3600,
+    "day": 86400,
+    "week": 7 * 86400,
+    "month": 30 * 86400,
+    "year": 365 * 86400,
+    "all": None,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    id TEXT PRIMARY KEY,
+    subreddit TEXT NOT NULL,
+    created_utc REAL NOT NULL,
+    score INTEGER NOT NULL,
+    num_comments INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    url TEXT NOT NULL,
+    media TEXT,
+    preview TEXT,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS posts_subreddit_created ON posts (subreddit, created_utc);
+CREATE INDEX IF NOT EXISTS posts_subreddit_score ON posts (subreddit, score);
+CREATE TABLE IF NOT EXISTS fetches (
+    subreddit TEXT NOT NULL,
+    time_filter TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    size INTEGER NOT NULL,
+    exhausted INTEGER NOT NULL,
+    PRIMARY KEY (subreddit, time_filter)
+);
+"""
+
+
+class ArchivedSubreddit(NamedTuple):
+    display_name: str
+
+
+class ArchivedPost(object):
+    """Post loaded from the archive, has the attributes of
+    praw.models.Submission the bot uses to send it
+    """
+
+    __slots__ = ("id", "subreddit", "created_utc", "ups", "num_comments",
+                 "title", "url", "media", "preview")
+
+    def __init__(self, row: sqlite3.Row) -> None:
+        self.id = row["id"]
+        self.subreddit = ArchivedSubreddit(row["subreddit"])
+        self.created_utc = row["created_utc"]
+        self.ups = row["score"]
+        self.num_comments = row["num_comments"]
+        self.title = row["title"]
+        self.url = row["url"]
+        self.media = json.loads(row["media"]) if row["media"] else None
+        self.preview = json.loads(row["preview"]) if row["preview"] else None
+
+
+def _video_part(value: Optional[Dict], key: str) -> Optional[str]:
+    '''Keep only the video part of media/preview, the rest
+    (image resolutions, oembed...) is never used
+    '''
+    if value and value.get(key):
+        return json.dumps({key: value[key]})
+    return None
+
+
+class PostArchive(object):
+    """On-disk archive of fetched posts (SQLite).
+    :param: path: database filename (or :memory:)
+    """
+
+    def __init__(self, path: str) -> None:
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+
+    def store(
+        self,
+        subreddit: str,
+        posts: Iterable[praw.models.Submission],
+        time_filter: str,
+        exhausted: bool = False
+    ) -> None:
+        '''Store fetched listing of the subreddit
+        :param: subreddit: subreddit name
+        :param: posts: fetched posts
+        :param: time_filter: time filter of the listing
+        :param: exhausted: True if reddit has no more posts for the time filter
+        '''
+        now = time.time()
+        rows = [(
+            post.id,
+            subreddit.lower(),
+            post.created_utc,
+            post.ups,
+            post.num_comments,
+            post.title,
+            post.url,
+            _video_part(getattr(post, "media", None), "reddit_video"),
+            _video_part(getattr(post, "preview", None), "reddit_video_preview"),
+            now,
+        ) for post in posts]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO fetches VALUES (?, ?, ?, ?, ?)",
+                (subreddit.lower(), time_filter, now, len(rows), int(exhausted))
+            )
+
+    def top(
+        self,
+        subreddit: str,
+        limit: int,
+        time_filter: str = "day",
+        max_age: float = None
+    ) -> Optional[List[ArchivedPost]]:
+        '''Return top archived posts of the subreddit for the time filter,
+        or None if the archive can't answer.
+        If max_age is given the listing must have been fetched within
+        max_age seconds, otherwise any archived posts are used.
+        :param: subreddit: subreddit name
+        :param: limit: number of posts
+        :param: time_filter: reddit time filter (hour, day, week...)
+        :param: max_age: freshness bound in seconds
+        '''
+        subreddit = subreddit.lower()
+        now = time.time()
+        period = TIME_FILTERS[time_filter]
+        since = now - period if period else 0
+        exhausted = False
+
+        with self._lock:
+            if max_age is not None:
+                fetch = self._conn.execute(
+                    "SELECT * FROM fetches WHERE subreddit = ? AND time_filter = ?",
+                    (subreddit, time_filter)
+                ).fetchone()
+                if (
+                    fetch is None
+                    or fetch["fetched_at"] < now - max_age
+                    or (fetch["size"] < limit and not fetch["exhausted"])
+                ):
+                    return None
+                exhausted = bool(fetch["exhausted"])
+
+            rows = self._conn.execute(
+                "SELECT * FROM posts WHERE subreddit = ? AND created_utc >= ? "
+                "ORDER BY score DESC LIMIT ?",
+                (subreddit, since, int(limit))
+            ).fetchall()
+
+        if len(rows) < int(limit) and not exhausted:
+            return None
+        return [ArchivedPost(x) for x in rows]
+
+    def compact(self, max_age: float) -> int:
+        '''Drop posts created more than max_age seconds ago,
+        returns number of dropped posts
+        :param: max_age: age in seconds
+        '''
+        threshold = time.time() - max_age
+        with self._lock, self._conn:
+            deleted = self._conn.execute(
+                "DELETE FROM posts WHERE created_utc < ?", (threshold,)
+            ).rowcount
+            self._conn.execute("DELETE FROM fetches WHERE fetched_at < ?", (threshold,))
+        return deleted
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -3,13 +3,20 @@
 # pylint: disable=W0613, C0116
 # type: ignore[union-attr]
 
+import io
 import os
 import praw
+from prawcore.exceptions import Forbidden, NotFound, Redirect
 import yaml
+import time
+import random
+import signal
 import logging
+import datetime
+import threading
 from pprint import pprint
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, List, Tuple
 
 
 from telegram.ext import (
@@ -17,30 +24,69 @@ from telegram.ext import (
     MessageHandler,
     Filters,
     CallbackQueryHandler,
+    InlineQueryHandler,
     Updater,
     ConversationHandler
 )
-from telegram.constants import PARSEMODE_MARKDOWN_V2
+from telegram.constants import PARSEMODE_MARKDOWN_V2, MAX_MESSAGE_LENGTH
+from telegram.utils.helpers import escape_markdown
+from telegram.error import TelegramError
+from apscheduler.events import EVENT_JOB_SUBMITTED
 from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InputMediaPhoto,
+    InputMediaVideo,
     Update,
     ReplyKeyboardMarkup,
+    ReplyKeyboardRemove,
     KeyboardButton,
 )
 
 from app.helpers import (
     load_yaml,
-    ChannelNotFoundError,
-    IncorrectDareError,
+    batched,
+    ChannelLookupError,
     IncorrectInputError
 )
 from app.logger import create_logger, applog
+from app.fetcher import ListingCache, RedditFetcher
+from app.executor import BlockingExecutor
+from app.store import get_database, SubscriptionStore
+from app.cluster import partition_of, LeaseManager, DEFAULT_PARTITIONS
+from app.digest import DigestBuffer, DigestEntry
+from app.profiler import ProfilingSession
+from app.archive import PostArchive, TIME_FILTERS
+from app.replay import UpdateRecorder
+from app.capacity import CapacityModel, REDDIT, TELEGRAM
+from app.inline import RecentListings, inline_result, parse_offset, parse_query, sent_file_id
+from app.payload import Payload, PayloadCache
+from app.cache import TTLCache
+from app.delivery import (
+    classify_error,
+    RetryItem,
+    RetryQueue,
+    CHAT_MIGRATED,
+    DROPPED,
+    PERMANENT_CHAT,
+    PERMANENT_MEDIA
+)
+from app.metrics import (
+    start_metrics_server,
+    ACTIVE_SUBSCRIPTIONS,
+    CACHE_REQUESTS,
+    CAPACITY_PROJECTED,
+    CAPACITY_UTILIZATION,
+    JOB_LAG_SECONDS,
+    QUEUE_DEPTH,
+    REDDIT_REQUEST_SECONDS,
+    TELEGRAM_SEND_SECONDS
+)
 
 TYPE_CHECKING = True
 
 if TYPE_CHECKING:
-    from telegram.ext import CallbackContext, Dispatcher
+    from telegram.ext import CallbackContext, Dispatcher, JobQueue
 
 
 class Bot(object):
@@ -63,16 +109,80 @@ class Bot(object):
 
     commands_md: Dict = {
         "start": "To show the menu",
-        "show": "To show latest n posts for a channel use `/show aww 3`, it will show 3 latest @aww posts",
+        "show": "To show latest n posts for a channel use `/show aww 3`, it will show 3 latest @aww posts, `/show aww 3 week` shows top posts of the week",
         "sub": "To subscribe to the channel use `/sub aww 0.5 1`, it will subscribe you to @aww, showing 1 post every 30 minutes",
+        "digest": "To get posts of subscriptions coming at the same time as one album use `/digest on`, to turn it off use `/digest off`",
     }
 
+    digest_line_md: str = "[{title}]({url}) r/{subreddit} \\- *{likes}* likes, *{coms}* comments"
+    # Telegram albums hold 2-10 photos and videos
+    album_max_size: int = 10
+
     main_menu_options = [
         ("Run subscription helper", "sub_helper"),
         ("Subscribe to top channels", "categories"),
         ("See manual (for linux lovers)", "show_help")
     ]
 
+    # Listings are kept for LISTING_TTL seconds, due subscriptions
+    # are prefetched every PREFETCH_INTERVAL seconds
+    default_listing_ttl: int = 300
+    default_listing_cache_size: int = 1000
+    default_prefetch_interval: int = 60
+    # Rendered post payloads are shared across chats for PAYLOAD_TTL seconds
+    default_payload_ttl: int = 3600
+    # Failed deliveries are retried every RETRY_INTERVAL seconds,
+    # media telegram can't fetch is skipped for BAD_MEDIA_TTL seconds
+    default_retry_interval: int = 5
+    default_retry_queue_size: int = 1000
+    default_bad_media_ttl: int = 86400
+    # Metrics are served on http://127.0.0.1:METRICS_PORT/metrics (0 - disabled)
+    default_metrics_port: int = 9108
+    # Blocking reddit calls of interactive handlers run in a separate
+    # pool of REDDIT_WORKERS threads, at most REDDIT_PER_USER per user
+    default_reddit_timeout: int = 10
+    default_reddit_workers: int = 4
+    default_reddit_pending: int = 100
+    default_reddit_per_user: int = 2
+    # In cluster mode instances hold leases on subscription partitions
+    # for CLUSTER_LEASE_TTL seconds, renewing them every CLUSTER_HEARTBEAT
+    # seconds, and reload subscriptions every CLUSTER_SYNC_INTERVAL seconds
+    default_cluster_lease_ttl: int = 30
+    default_cluster_heartbeat: int = 10
+    default_cluster_sync_interval: int = 60
+    # Posts of subscriptions coming due within DIGEST_WINDOW seconds
+    # are sent as one digest to chats in digest mode
+    default_digest_window: int = 300
+    # Fetched posts are archived to ARCHIVE_PATH (if set), listings are
+    # served from the archive for ARCHIVE_FRESHNESS seconds and posts
+    # older than ARCHIVE_MAX_AGE seconds are dropped
+    default_archive_freshness: int = 600
+    default_archive_max_age: int = 30 * 86400
+    default_archive_compact_interval: int = 3600
+    # /profile is available to ADMIN_CHAT_IDS only
+    default_profile_seconds: int = 30
+    max_profile_seconds: int = 300
+    # New subscriptions are admitted while the projected load of all
+    # subscriptions fits REDDIT_CALLS_PER_HOUR and TELEGRAM_SENDS_PER_HOUR,
+    # a chat gets at most MAX_SUBSCRIPTIONS and CHAT_SENDS_PER_HOUR.
+    # Intervals shorter than MIN_INTERVAL seconds are coarsened.
+    default_reddit_calls_per_hour: int = 3000
+    default_telegram_sends_per_hour: int = 54000
+    default_chat_sends_per_hour: int = 120
+    default_max_subscriptions: int = 20
+    default_min_interval: int = 300
+    default_max_interval: int = 86400
+    default_max_posts: int = 10
+    # Inline queries (@bot aww) are answered from listings kept in memory
+    # for INLINE_TTL seconds (refreshed in background after LISTING_TTL)
+    # and media uploaded before, telegram caches answers for
+    # INLINE_CACHE_TIME seconds
+    default_inline_ttl: int = 3600
+    default_inline_cache_time: int = 300
+    default_file_id_ttl: int = 7 * 86400
+    inline_page_size: int = 20
+    inline_listing_size: int = 50
+
     time_range_options = ["1", "4", "8", "12", "24"]
     posts_limit_options = ["1", "3", "5", "10"]
 
@@ -85,6 +195,13 @@ class Bot(object):
         "timerange": 'How often do you want to see new posts \(in hours\)?',
     }
 
+    reddit_busy_text: str = "Too many requests, please try again in a moment"
+    reddit_error_text: str = "Reddit is not responding, please /cancel and try again later"
+    channel_not_found_text: str = "Channel not found, send another name or /cancel"
+    channel_pending_text: str = "Still looking for the channel, please try again in a moment"
+    number_expected_text: str = "Please send a number or /cancel"
+    inline_loading_text: str = "Loading r/{name}, type again in a moment"
+
     def __init__(
         self,
         config_file: str = default_config_filename,
@@ -95,6 +212,33 @@ class Bot(object):
         self.log = self._get_logger(self.cfg['LOG_LEVEL'])
         self._init_clients()
 
+        self.retries = RetryQueue(
+            self.cfg.get('RETRY_QUEUE_SIZE', self.default_retry_queue_size)
+        )
+        self.bad_media = TTLCache(
+            self.cfg.get('BAD_MEDIA_TTL', self.default_bad_media_ttl)
+        )
+        # Media url -> telegram file_id of the uploaded media
+        self.file_ids = TTLCache(
+            self.cfg.get('FILE_ID_TTL', self.default_file_id_ttl),
+            max_size=100000
+        )
+        self.capacity = CapacityModel(
+            reddit_calls_per_hour=self.cfg.get('REDDIT_CALLS_PER_HOUR', self.default_reddit_calls_per_hour),
+            telegram_sends_per_hour=self.cfg.get('TELEGRAM_SENDS_PER_HOUR', self.default_telegram_sends_per_hour),
+            user_sends_per_hour=self.cfg.get('CHAT_SENDS_PER_HOUR', self.default_chat_sends_per_hour),
+            max_subscriptions=self.cfg.get('MAX_SUBSCRIPTIONS', self.default_max_subscriptions),
+            min_interval=self.cfg.get('MIN_INTERVAL', self.default_min_interval),
+            max_interval=self.cfg.get('MAX_INTERVAL', self.default_max_interval),
+            max_limit=self.cfg.get('MAX_POSTS', self.default_max_posts),
+            listing_ttl=self.cfg.get('LISTING_TTL', self.default_listing_ttl)
+        )
+        self.paused_chats = set()
+        self.digests = DigestBuffer()
+        self.digest_chats = set()
+        self.profiling = None
+        self._profiling_lock = threading.Lock()
+
     @property
     def name(self):
         '''Returns name of the bot
@@ -133,6 +277,55 @@ class Bot(object):
         Like reddit and (!TODO)9gag
         '''
         self.reddit = self._init_reddit_client()
+        self.archive = PostArchive(self.cfg['ARCHIVE_PATH']) if self.cfg.get('ARCHIVE_PATH') else None
+        self.fetcher = RedditFetcher(
+            self.reddit,
+            ListingCache(
+                self.cfg.get('LISTING_TTL', self.default_listing_ttl),
+                self.cfg.get('LISTING_CACHE_SIZE', self.default_listing_cache_size)
+            ),
+            self.log,
+            self.archive,
+            self.cfg.get('ARCHIVE_FRESHNESS', self.default_archive_freshness)
+        )
+        self.payloads = PayloadCache(
+            self.cfg.get('PAYLOAD_TTL', self.default_payload_ttl)
+        )
+        self.recent = RecentListings(
+            self.cfg.get('INLINE_TTL', self.default_inline_ttl)
+        )
+        self.fetcher.listeners.append(self.recent.put)
+        # Subscriptions are persisted only if the database is configured
+        partitions = self.cfg.get('CLUSTER_PARTITIONS', DEFAULT_PARTITIONS)
+        self.store = None
+        if self.cfg.get('MONGO_URI'):
+            self.store = SubscriptionStore(get_database(self.cfg), partitions)
+
+        self.leases = None
+        if self.cfg.get('CLUSTER'):
+            if not self.store:
+                raise ValueError("Cluster mode requires MONGO_URI and MONGO_DB")
+            self.leases = LeaseManager(
+                self.store.db,
+                partitions,
+                self.cfg.get('CLUSTER_LEASE_TTL', self.default_cluster_lease_ttl)
+            )
+            heartbeat = self.cfg.get('CLUSTER_HEARTBEAT', self.default_cluster_heartbeat)
+            if heartbeat >= self.leases.ttl - self.leases.safety_margin:
+                raise ValueError(
+                    f"CLUSTER_HEARTBEAT ({heartbeat}) must be less than CLUSTER_LEASE_TTL "
+                    f"minus the {self.leases.safety_margin:g}s safety margin"
+                )
+        self._partition_jobs: Dict[int, Dict[Tuple, object]] = {}
+        self._partitions_lock = threading.Lock()
+        self._last_full_sync = 0.0
+        self.reddit_executor = BlockingExecutor(
+            max_workers=self.cfg.get('REDDIT_WORKERS', self.default_reddit_workers),
+            max_pending=self.cfg.get('REDDIT_PENDING', self.default_reddit_pending),
+            per_user=self.cfg.get('REDDIT_PER_USER', self.default_reddit_per_user),
+            timeout=self.cfg.get('REDDIT_TIMEOUT', self.default_reddit_timeout),
+            log=self.log
+        )
 
     @applog
     def _init_reddit_client(self) -> praw.Reddit:
@@ -145,9 +338,59 @@ class Bot(object):
             client_secret="",
             password=self.cfg['REDDIT_USERNAME'],
             user_agent="USERAGENT",
-            username=self.cfg['REDDIT_PASSWORD']
+            username=self.cfg['REDDIT_PASSWORD'],
+            timeout=self.cfg.get('REDDIT_TIMEOUT', self.default_reddit_timeout)
         )
 
+    def _reply(self, update: Update, text: str) -> None:
+        '''Reply to the message or edit the callback query message
+        :param: update: telegram.Update object
+        :param: text: text of the reply
+        '''
+        if update.message:
+            update.message.reply_text(text)
+        else:
+            update.callback_query.edit_message_text(text)
+
+    def _run_blocking(
+        self,
+        update: Update,
+        func: Callable,
+        *args,
+        on_done: Callable = None,
+        on_failure: Callable = None
+    ) -> bool:
+        '''Run blocking reddit call in the reddit executor and pass
+        its result to on_done (called in the executor thread too).
+        Tells the user if the executor is busy, the channel doesn't
+        exist or the call failed. Returns False if the call was rejected.
+        :param: update: telegram.Update object
+        :param: func: blocking function
+        :param: on_done: callback for the result
+        :param: on_failure: called with the exception after the user is told
+        '''
+        def on_error(e):
+            if isinstance(e, ChannelLookupError):
+                self.log.info(f"{func.__name__}: {e}")
+                self._reply(update, self.channel_not_found_text)
+            else:
+                self.log.error(f"{func.__name__} failed: {e!r}", exc_info=e)
+                self._reply(update, self.reddit_error_text)
+            if on_failure:
+                on_failure(e)
+
+        accepted = self.reddit_executor.submit(
+            update.effective_user.id,
+            func,
+            *args,
+            on_done=on_done,
+            on_error=on_error
+        )
+        if not accepted:
+            self.log.warning(f"Reddit executor is busy, rejected {func.__name__}")
+            self._reply(update, self.reddit_busy_text)
+        return accepted
+
     @applog
     def subscribe_on_reddit_channel(
         self,
@@ -169,31 +412,54 @@ class Bot(object):
         chat_id = chat_id or update.message.from_user.id
         try:
             interval = (interval or float(context.args[1]) * 60) * 60
-            if not interval or interval < 0:
-                self.log.debug(f"Incorrect date set: {interval}")
-                raise IncorrectDareError
-
             limit = limit or int(context.args[2]) or 1
 
-            job = self.send_reddit_post
+            decision = self.capacity.admit(chat_id, channel.display_name, limit, interval)
+            if not decision.accepted:
+                self.log.info(f"Subscription of chat_id {chat_id} rejected: {decision.reason}")
+                self._reply(update, f'Subscription rejected: {decision.reason}')
+                return
+            if decision.reason:
+                self.log.info(f"Subscription of chat_id {chat_id} adjusted: {decision.reason}")
+            limit, interval = decision.limit, decision.interval
 
-            self.log.info(f"Registering job {job} for chat_id {chat_id}, interval {interval}, limit {limit}")
-            context.job_queue.run_repeating(
-                job,
-                name=str(chat_id),
-                context={'chat_id': chat_id, 'channel': channel, 'limit': limit},
-                interval=interval,
-                first=10
-            )
-            self.log.info("Job registered")
+            job = self.send_reddit_post
 
+            if self.leases:
+                # The instance holding the partition schedules the job
+                self.store.save(chat_id, channel.display_name, limit, interval, str(chat_id) in self.digest_chats)
+                partition = partition_of(chat_id, self.leases.partitions)
+                if self.leases.owns(partition):
+                    self._load_partitions(context.job_queue, {partition})
+                self.log.info(f"Subscription of chat_id {chat_id} saved to partition {partition}")
+            else:
+                # Subscribing again to the same channel replaces the subscription
+                for old in context.job_queue.get_jobs_by_name(str(chat_id)):
+                    if old.context['channel'].display_name.lower() == channel.display_name.lower():
+                        old.schedule_removal()
+                self.log.info(f"Registering job {job} for chat_id {chat_id}, interval {interval}, limit {limit}")
+                context.job_queue.run_repeating(
+                    job,
+                    name=str(chat_id),
+                    context={'chat_id': chat_id, 'channel': channel, 'limit': limit, 'interval': interval},
+                    interval=interval,
+                    first=10
+                )
+                self.log.info("Job registered")
+                if self.store:
+                    self.store.save(chat_id, channel.display_name, limit, interval, str(chat_id) in self.digest_chats)
+            self.capacity.add(chat_id, channel.display_name, limit, interval)
+
+            text = 'Timer successfully set!'
+            if decision.reason:
+                text += f' ({decision.reason})'
             if update.message:
-                update.message.reply_text('Timer successfully set!')
+                update.message.reply_text(text)
             else:
-                update.callback_query.edit_message_text('Timer successfully set!')
+                update.callback_query.edit_message_text(text)
 
         except (IndexError, ValueError) as e:
-            self.log.error(f"An error occured {e.message}")
+            self.log.error(f"An error occured {e!r}")
 
             if update.message:
                 update.message.reply_text('Please use command: /set <seconds>')
@@ -212,13 +478,224 @@ class Bot(object):
         '''
         chat_id = update.message.from_user.id
         job_removed = remove_jobs_if_exists(str(chat_id), context)
+        if self.store:
+            self.store.remove(chat_id)
+        self.capacity.remove(chat_id)
         text = 'You are successfully unsubscribed!' if job_removed else 'You have no active subscriptions.'
         update.message.reply_text(text)
 
+    @applog
+    def set_digest(
+        self,
+        update: Update,
+        context: CallbackContext,
+    ) -> None:
+        '''Digest mode handler (/digest on|off).
+        :param: update: telegram.Update object
+        :param: context: telegram.ext.CallbackContext object
+        '''
+        chat_id = str(update.effective_chat.id)
+        mode = context.args[0].lower() if context.args else "on"
+        if mode == "off":
+            self.digest_chats.discard(chat_id)
+            update.message.reply_text('Digest mode is off, posts will come one by one')
+        else:
+            self.digest_chats.add(chat_id)
+            update.message.reply_text('Digest mode is on, posts coming at the same time will be merged')
+        # Jobs may run on another instance or after a restart
+        if self.store:
+            self.store.set_digest(chat_id, mode != "off")
+
+    def _is_admin(self, update: Update) -> bool:
+        '''Check if the update comes from admin chat (ADMIN_CHAT_IDS)
+        :param: update: telegram.Update object
+        '''
+        return bool(update.effective_chat) and \
+            update.effective_chat.id in self.cfg.get('ADMIN_CHAT_IDS', [])
+
+    @applog
+    def start_profiling(
+        self,
+        update: Update,
+        context: CallbackContext,
+    ) -> None:
+        '''Admin handler (/profile [seconds] [cpu|mem]), profiles the running
+        bot and sends top functions and allocation sites as a file.
+        :param: update: telegram.Update object
+        :param: context: telegram.ext.CallbackContext object
+        '''
+        if not self._is_admin(update):
+            self.log.warning(f"Rejected /profile from chat_id {update.effective_chat.id}")
+            return
+
+        args = context.args or []
+        try:
+            seconds = float(args[0]) if args else self.default_profile_seconds
+        except ValueError:
+            update.message.reply_text('Please use command: /profile <seconds> [cpu|mem]')
+            return
+        seconds = min(max(seconds, 1), self.max_profile_seconds)
+        mode = args[1].lower() if len(args) > 1 else "all"
+
+        with self._profiling_lock:
+            if self.profiling:
+                update.message.reply_text('Profiling is already running')
+                return
+            self.profiling = ProfilingSession(cpu=mode != "mem", memory=mode != "cpu")
+            self.profiling.start()
+
+        context.job_queue.run_once(
+            self.finish_profiling,
+            seconds,
+            context={'chat_id': update.effective_chat.id},
+            name="profiling"
+        )
+        update.message.reply_text(f'Profiling for {seconds:g}s')
+
+    @applog
+    def finish_profiling(self, context: CallbackContext) -> None:
+        '''Stop profiling and send the report to the admin chat
+        :param: context: telegram.ext.CallbackContext object
+        '''
+        with self._profiling_lock:
+            session, self.profiling = self.profiling, None
+        if not session:
+            return
+
+        report = session.stop()
+        context.bot.send_document(
+            chat_id=context.job.context['chat_id'],
+            document=io.BytesIO(report.encode()),
+            filename=f"profile-{int(session.started_at)}.txt"
+        )
+
+    @applog
+    def show_capacity(
+        self,
+        update: Update,
+        context: CallbackContext,
+    ) -> None:
+        '''Admin handler (/capacity), shows projected load of the
+        active subscriptions against the budget.
+        :param: update: telegram.Update object
+        :param: context: telegram.ext.CallbackContext object
+        '''
+        if not self._is_admin(update):
+            self.log.warning(f"Rejected /capacity from chat_id {update.effective_chat.id}")
+            return
+
+        usage = self.capacity.usage()
+        update.message.reply_text("\n".join(
+            f"{resource}: {usage[resource]:.0f}/h of {budget:.0f}/h ({usage[resource] * 100 / budget:.1f}%)"
+            for resource, budget in self.capacity.budget.items()
+        ))
+
+    @applog
+    def answer_inline_query(
+        self,
+        update: Update,
+        context: CallbackContext,
+    ) -> None:
+        '''Inline query handler (@bot aww), answers photos, gifs and
+        videos of the subreddit from memory only. Unknown subreddits
+        get a loading answer while the listing is fetched in background.
+        :param: update: telegram.Update object
+        :param: context: telegram.ext.CallbackContext object
+        '''
+        query = update.inline_query
+        cache_time = self.cfg.get('INLINE_CACHE_TIME', self.default_inline_cache_time)
+        name = parse_query(query.query)
+        if not name:
+            self._answer_inline(query, [], cache_time=cache_time)
+            return
+
+        listing = self.recent.get(name)
+        CACHE_REQUESTS.inc(cache="inline", result="miss" if listing is None else "hit")
+        if listing is None or listing[1] > self.cfg.get('LISTING_TTL', self.default_listing_ttl):
+            self._load_inline_listing(query.from_user.id, name)
+        if listing is None:
+            self._answer_inline(
+                query,
+                [],
+                cache_time=0,
+                switch_pm_text=self.inline_loading_text.format(name=name),
+                switch_pm_parameter="loading"
+            )
+            return
+
+        posts = listing[0]
+        offset = parse_offset(query.offset)
+        end = offset + self.inline_page_size
+        results = []
+        for post in posts[offset:end]:
+            # One post which can't be rendered must not fail the whole answer
+            try:
+                payload = self.payloads.get(post, self._render_payload)
+            except (AttributeError, KeyError, TypeError) as e:
+                self.log.warning(f"Skipping post {post.id} of r/{name} in inline results: {e!r}")
+                continue
+            if payload.media in self.bad_media:
+                continue
+            result = inline_result(post, payload, self.file_ids.get(payload.media))
+            if result:
+                results.append(result)
+
+        self._answer_inline(
+            query,
+            results,
+            cache_time=cache_time,
+            next_offset=str(end) if end < len(posts) else ""
+        )
+
+    def _answer_inline(self, query, results: List, **kwargs) -> None:
+        '''Answer the inline query, telegram rejects answers
+        to queries which are too old
+        :param: query: telegram.InlineQuery object
+        :param: results: inline query results
+        '''
+        start = time.perf_counter()
+        try:
+            query.answer(results, **kwargs)
+        except TelegramError as e:
+            TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - start, method="answer_inline_query", outcome=classify_error(e))
+            self.log.warning(f"Failed to answer inline query {query.id}: {e}")
+            return
+        TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - start, method="answer_inline_query", outcome="ok")
+
+    def _load_inline_listing(self, user_id: int, name: str) -> None:
+        '''Fetch listing of the subreddit for inline queries in
+        the reddit executor, unless it's being fetched already
+        :param: user_id: id of the user who asked for it
+        :param: name: subreddit name
+        '''
+        if not self.recent.start_loading(name):
+            return
+
+        def fetch():
+            return self.fetcher.top(self.reddit.subreddit(name), self.inline_listing_size)
+
+        def on_error(e):
+            self.log.warning(f"Failed to load r/{name} for inline queries: {e!r}")
+            if isinstance(e, (Forbidden, NotFound, Redirect)):
+                # Unknown or private subreddit, answered empty until the listing expires
+                self.recent.put(name, [], exhausted=True)
+            else:
+                self.recent.stop_loading(name)
+
+        accepted = self.reddit_executor.submit(
+            user_id,
+            fetch,
+            on_done=lambda posts: self.recent.put(name, posts),
+            on_error=on_error
+        )
+        if not accepted:
+            self.recent.stop_loading(name)
+
     def get_popular_subreddits(self) -> List[praw.models.Subreddit]:
         '''Get list of popular subreddits
         '''
-        return list(self.reddit.subreddits.popular())
+        with REDDIT_REQUEST_SECONDS.time(endpoint="popular"):
+            return list(self.reddit.subreddits.popular())
 
     @applog
     def show_posts(
@@ -230,10 +707,19 @@ class Bot(object):
         :param: update: telegram.Update object
         :param: context: telegram.ext.CallbackContext object
         '''
-        channel = self.get_channel(context)
         chat_id = update.message.from_user.id
         limit = context.args[1]
-        self.send_reddit_post(context, channel, chat_id, limit)
+        time_filter = context.args[2].lower() if len(context.args) > 2 else "day"
+        if time_filter not in TIME_FILTERS:
+            update.message.reply_text(f'Time range must be one of: {", ".join(TIME_FILTERS)}')
+            return
+
+        self._run_blocking(
+            update,
+            self.get_channel,
+            context,
+            on_done=lambda channel: self.send_reddit_post(context, channel, chat_id, limit, time_filter)
+        )
 
     @applog
     def send_reddit_post(
@@ -241,105 +727,518 @@ class Bot(object):
         context: CallbackContext,
         channel: praw.reddit.Subreddit = None,
         chat_id: int = None,
-        limit: int = None
+        limit: int = None,
+        time_filter: str = None
     ) -> None:
         '''Send reddit submissions to the specific chat(user).
         :param: context: telegram.ext.CallbackContext object
         :param: channel: (praw.reddit.Subreddit object)
         :chat_id: chat_id to send a post
         :limit: number of posts to show
+        :time_filter: reddit time filter of top posts (day by default)
         '''
+        if self.leases and context.job and not self.leases.owns(context.job.context['partition']):
+            self.log.debug(f"Lease of partition {context.job.context['partition']} is lost, skipping")
+            return
+
         channel = channel or context.job.context['channel']
         chat_id = chat_id or context.job.context['chat_id']
         limit = limit or context.job.context['limit']
-        s = list(channel.top(time_filter="day", limit=int(limit)))
+        s = self.fetcher.top(channel, limit, time_filter)
+        if context.job and str(chat_id) in self.digest_chats:
+            for post in s:
+                self._add_to_digest(context, post, chat_id)
+            return
+
         for post in s:
-            self._send_reddit_post(context, post, chat_id)
+            if not self._send_reddit_post(context, post, chat_id):
+                break
 
-    @applog
-    def _send_reddit_post(
+    def _add_to_digest(
         self,
         context: CallbackContext,
         post: praw.models.Submission,
         chat_id: int
     ) -> None:
-        '''Send reddit submission to the specific chat(user). 
+        '''Buffer reddit submission to the chat digest, schedule
+        the digest delivery if it's the first post
         :param: context: telegram.ext.CallbackContext object
         :param: post: reddit submission (praw.models.Submissions)
         :chat_id: chat_id to send a post
         '''
-        self.log.debug(f"Sending post {post.id} to chat_id {chat_id}")
-        # pprint(post.__dict__)
-        if getattr(post, "media"):
-            video = post.media.get('reddit_video') or post.preview['reddit_video_preview']
-
-            self.log.debug(f"Starting video {video['fallback_url']} stream")
-            context.bot.send_video(
-                chat_id=chat_id,
-                video=video['fallback_url'],
-                caption=self.caption.format(
-                    title=post.title,
-                    likes=post.ups,
-                    coms=post.num_comments
-                ),
-                parse_mode=PARSEMODE_MARKDOWN_V2
+        entry = DigestEntry(
+            payload=self.payloads.get(post, self._render_payload),
+            subreddit=post.subreddit.display_name,
+            title=post.title,
+            url=f"https://redd.it/{post.id}",
+            likes=post.ups,
+            coms=post.num_comments
+        )
+        if self.digests.add(chat_id, entry):
+            window = self.cfg.get('DIGEST_WINDOW', self.default_digest_window)
+            self.log.debug(f"Scheduling digest of chat_id {chat_id} in {window}s")
+            context.job_queue.run_once(
+                self.send_digest,
+                window,
+                context={'chat_id': chat_id},
+                name=f"digest-{chat_id}"
             )
-            self.log.debug("Video sent")
 
-        elif getattr(post, "preview"):
-            if post.preview.get('reddit_video_preview'):
-                anim_url = post.preview['reddit_video_preview']['fallback_url']
-                self.log.debug(f"Starting animation {anim_url} stream")
+    @applog
+    def send_digest(self, context: CallbackContext) -> None:
+        '''Send buffered posts of the chat as albums and
+        a text index of links with the posts stats
+        :param: context: telegram.ext.CallbackContext object
+        '''
+        chat_id = context.job.context['chat_id']
+        entries = self.digests.pop(chat_id)
+        if not entries or str(chat_id) in self.paused_chats:
+            return
 
-                context.bot.send_animation(
+        album = [
+            x.payload for x in entries
+            if x.payload.kind in ("photo", "video") and x.payload.media not in self.bad_media
+        ]
+        for chunk in batched(album, self.album_max_size):
+            if not self._send_album(context, chat_id, chunk):
+                return
+        sent = {x.media for x in album}
+
+        # Animations can't be put to albums
+        for entry in entries:
+            if entry.payload.kind == "animation" and entry.payload.media not in sent:
+                if not self._deliver(context, RetryItem(chat_id, entry.payload)):
+                    return
+                sent.add(entry.payload.media)
+
+        for chunk in self._digest_index(entries):
+            text = "\n".join(line for line, _ in chunk)
+            try:
+                context.bot.send_message(
                     chat_id=chat_id,
-                    animation=anim_url,
-                    caption=self.caption.format(
-                        title=post.title,
-                        likes=post.ups,
-                        coms=post.num_comments
-                    ),
-                    parse_mode=PARSEMODE_MARKDOWN_V2
+                    text=text,
+                    parse_mode=PARSEMODE_MARKDOWN_V2,
+                    disable_web_page_preview=True
                 )
-                self.log.debug("Animation sent")
+            except TelegramError as e:
+                self.log.warning(f"Failed to send digest index to chat_id {chat_id}: {e}")
+                error_kind = classify_error(e)
+                if error_kind == PERMANENT_CHAT:
+                    self.pause_chat(context, chat_id)
+                    return
+                if error_kind == CHAT_MIGRATED:
+                    self.migrate_chat(context, chat_id, e.new_chat_id)
+                    chat_id = e.new_chat_id
+                # Posts which were only listed in the index are sent one by one
+                for _, entry in chunk:
+                    if entry.payload.media not in sent:
+                        if not self._deliver(context, RetryItem(chat_id, entry.payload)):
+                            return
+                        sent.add(entry.payload.media)
+
+    def _digest_index(self, entries: List[DigestEntry]) -> List[List[Tuple[str, DigestEntry]]]:
+        '''Render digest index lines, split into messages
+        telegram accepts
+        :param: entries: digest entries
+        '''
+        chunks: List[List[Tuple[str, DigestEntry]]] = [[]]
+        length = 0
+        for entry in entries:
+            line = self.digest_line_md.format(
+                title=escape_markdown(entry.title, version=2),
+                url=entry.url,
+                subreddit=escape_markdown(entry.subreddit, version=2),
+                likes=escape_markdown(str(entry.likes), version=2),
+                coms=escape_markdown(str(entry.coms), version=2)
+            )
+            if chunks[-1] and length + 1 + len(line) > MAX_MESSAGE_LENGTH:
+                chunks.append([])
+                length = 0
+            length += len(line) + (1 if chunks[-1] else 0)
+            chunks[-1].append((line, entry))
+        return [x for x in chunks if x]
+
+    def _send_album(self, context: CallbackContext, chat_id: int, payloads: List[Payload]) -> bool:
+        '''Send payloads as a single album. If telegram rejects the album
+        the payloads are delivered one by one.
+        Returns False if the chat can't receive posts anymore.
+        :param: context: telegram.ext.CallbackContext object
+        :param: chat_id: chat_id
+        :param: payloads: list of photo and video payloads
+        '''
+        if len(payloads) == 1:
+            return self._deliver(context, RetryItem(chat_id, payloads[0]))
 
-            else:
-                self._send_img_to_chat(chat_id, context, post)
+        media_types = {"photo": InputMediaPhoto, "video": InputMediaVideo}
+        start = time.perf_counter()
+        try:
+            messages = context.bot.send_media_group(
+                chat_id=chat_id,
+                media=[media_types[x.kind](x.media) for x in payloads]
+            )
+        except TelegramError as e:
+            error_kind = classify_error(e)
+            TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - start, method="send_media_group", outcome=error_kind)
+            self.log.warning(f"Failed to send album to chat_id {chat_id} ({error_kind}): {e}")
+            if error_kind == PERMANENT_CHAT:
+                self.pause_chat(context, chat_id)
+                return False
+            if error_kind == CHAT_MIGRATED:
+                self.migrate_chat(context, chat_id, e.new_chat_id)
+                return self._send_album(context, e.new_chat_id, payloads)
+            for payload in payloads:
+                if not self._deliver(context, RetryItem(chat_id, payload)):
+                    return False
+            return True
+
+        TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - start, method="send_media_group", outcome="ok")
+        for payload, message in zip(payloads, messages or []):
+            self._keep_file_id(payload, message)
+        return True
 
-        else:
-            self._send_img_to_chat(chat_id, context, post)
+    @applog
+    def prefetch_due_listings(self, context: CallbackContext) -> None:
+        '''Fetch listings of all subscriptions which are due before
+        the next prefetch run, using combined subreddit requests.
+        :param: context: telegram.ext.CallbackContext object
+        '''
+        interval = self.cfg.get('PREFETCH_INTERVAL', self.default_prefetch_interval)
+        horizon = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=interval)
+
+        limits: Dict[str, int] = {}
+        for job in context.job_queue.jobs():
+            if job.callback != self.send_reddit_post or not job.enabled:
+                continue
+            if job.next_t is None or job.next_t > horizon:
+                continue
+            name = job.context['channel'].display_name
+            limits[name] = max(limits.get(name, 0), int(job.context['limit']))
+
+        self.log.debug(f"Prefetching {len(limits)} due listings")
+        self.fetcher.fetch_many(limits)
+        self.payloads.evict_expired()
+        self.fetcher.cache.evict_expired()
 
-    def _send_img_to_chat(
+    @applog
+    def _send_reddit_post(
         self,
-        chat_id: str,
         context: CallbackContext,
-        post: praw.models.Submission
-    ) -> None:
-        '''Extract img from reddir object and
-        send to the given chat
-        '''
-        self.log.debug(f"Starting photo {post.url} stream")
-        context.bot.send_photo(
-            chat_id=chat_id,
-            photo=post.url,
-            caption=self.caption.format(
-                title=post.title,
-                likes=post.ups,
-                coms=post.num_comments
-            ),
-            parse_mode=PARSEMODE_MARKDOWN_V2
+        post: praw.models.Submission,
+        chat_id: int
+    ) -> bool:
+        '''Send reddit submission to the specific chat(user).
+        Returns False if the chat can't receive posts anymore.
+        :param: context: telegram.ext.CallbackContext object
+        :param: post: reddit submission (praw.models.Submissions)
+        :chat_id: chat_id to send a post
+        '''
+        self.log.debug(f"Sending post {post.id} to chat_id {chat_id}")
+        payload = self.payloads.get(post, self._render_payload)
+        return self._deliver(context, RetryItem(chat_id, payload))
+
+    def _deliver(self, context: CallbackContext, item: RetryItem) -> bool:
+        '''Send rendered payload and handle delivery failures:
+        retryable ones go to the retry queue, unreachable chats
+        are paused, migrated chats are moved to the new chat_id
+        and bad media is remembered.
+        Returns False if the chat can't receive posts anymore.
+        :param: context: telegram.ext.CallbackContext object
+        :param: item: delivery (app.delivery.RetryItem)
+        '''
+        chat_id, payload = item.chat_id, item.payload
+        method = f"send_{payload.kind}"
+        if payload.media in self.bad_media:
+            self.log.debug(f"Skipping known bad {payload.kind} {payload.media}")
+            TELEGRAM_SEND_SECONDS.observe(0, method=method, outcome="skipped")
+            return True
+
+        self.log.debug(f"Starting {payload.kind} {payload.media} stream")
+        send = getattr(context.bot, method)
+        start = time.perf_counter()
+        try:
+            message = send(
+                chat_id=chat_id,
+                caption=payload.caption,
+                parse_mode=PARSEMODE_MARKDOWN_V2,
+                **{payload.kind: payload.media}
+            )
+        except TelegramError as e:
+            error_kind = classify_error(e)
+            TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - start, method=method, outcome=error_kind)
+            self.log.warning(f"Failed to send {payload.kind} to chat_id {chat_id} ({error_kind}): {e}")
+
+            if error_kind == PERMANENT_CHAT:
+                self.pause_chat(context, chat_id)
+                return False
+            if error_kind == CHAT_MIGRATED:
+                self.migrate_chat(context, chat_id, e.new_chat_id)
+                return self._deliver(context, item._replace(chat_id=e.new_chat_id))
+            if error_kind == PERMANENT_MEDIA:
+                self.bad_media.set(payload.media, True)
+            elif error_kind == DROPPED:
+                self.log.warning(f"Dropping {payload.kind} {payload.media} for chat_id {chat_id}")
+            elif not self.retries.push(item._replace(attempts=item.attempts + 1), e):
+                self.log.warning(f"Dropping {payload.kind} {payload.media} for chat_id {chat_id}")
+            return True
+
+        TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - start, method=method, outcome="ok")
+        self.log.debug(f"{payload.kind.capitalize()} sent")
+        self._keep_file_id(payload, message)
+        return True
+
+    def _keep_file_id(self, payload: Payload, message) -> None:
+        '''Remember file_id of the sent media, so inline results
+        reuse it instead of making telegram fetch the url again
+        :param: payload: sent payload (app.payload.Payload)
+        :param: message: sent message (telegram.Message)
+        '''
+        file_id = sent_file_id(message, payload.kind)
+        if file_id:
+            self.file_ids.set(payload.media, file_id)
+
+    def retry_failed_deliveries(self, context: CallbackContext) -> None:
+        '''Send again all failed deliveries which are due for retry
+        :param: context: telegram.ext.CallbackContext object
+        '''
+        for item in self.retries.pop_due():
+            if str(item.chat_id) not in self.paused_chats:
+                self._deliver(context, item)
+
+    @applog
+    def sync_partitions(self, context: CallbackContext) -> None:
+        '''Renew partition leases, rebalance them between instances
+        and schedule jobs of the subscriptions this instance holds.
+        :param: context: telegram.ext.CallbackContext object
+        '''
+        gained, lost = self.leases.rebalance()
+        if gained or lost:
+            self.log.info(f"Partitions gained {sorted(gained)}, lost {sorted(lost)}")
+
+        for partition in lost:
+            self._drop_partition(partition)
+
+        interval = self.cfg.get('CLUSTER_SYNC_INTERVAL', self.default_cluster_sync_interval)
+        if time.monotonic() - self._last_full_sync >= interval:
+            self._last_full_sync = time.monotonic()
+            self._load_partitions(context.job_queue, self.leases.owned)
+            # The budget is shared by the cluster, account all subscriptions
+            self.capacity.load(self.store.iter_all())
+        elif gained:
+            self._load_partitions(context.job_queue, gained)
+
+    def _load_partitions(self, job_queue, partitions) -> None:
+        '''Make scheduled jobs of the partitions match the stored
+        subscriptions: schedule new ones, drop removed or changed ones.
+        :param: job_queue: telegram.ext.JobQueue object
+        :param: partitions: partition numbers
+        '''
+        wanted: Dict[int, Dict[Tuple, Dict]] = {x: {} for x in partitions}
+        for doc in self.store.find_partitions(partitions):
+            wanted[doc['partition']][(doc['chat_id'], doc['subreddit'])] = doc
+            if doc.get('digest'):
+                self.digest_chats.add(str(doc['chat_id']))
+            else:
+                self.digest_chats.discard(str(doc['chat_id']))
+
+        with self._partitions_lock:
+            for partition, docs in wanted.items():
+                jobs = self._partition_jobs.setdefault(partition, {})
+                for key, job in list(jobs.items()):
+                    doc = docs.get(key)
+                    if not doc or (doc['limit'], doc['interval']) != (job.context['limit'], job.context['interval']):
+                        job.schedule_removal()
+                        del jobs[key]
+
+                for key, doc in docs.items():
+                    if key in jobs:
+                        continue
+                    jobs[key] = job_queue.run_repeating(
+                        self.send_reddit_post,
+                        name=str(doc['chat_id']),
+                        context={
+                            'chat_id': doc['chat_id'],
+                            'channel': self.reddit.subreddit(doc['subreddit']),
+                            'limit': doc['limit'],
+                            'interval': doc['interval'],
+                            'partition': partition,
+                        },
+                        interval=doc['interval'],
+                        # Spread jobs of a gained partition over the interval
+                        first=random.uniform(10, max(doc['interval'], 10))
+                    )
+
+    def _load_subscriptions(self, job_queue) -> None:
+        '''Schedule jobs of all stored subscriptions, subscriptions
+        of paused chats are scheduled disabled
+        :param: job_queue: telegram.ext.JobQueue object
+        '''
+        docs = list(self.store.iter_all())
+        for doc in docs:
+            job = job_queue.run_repeating(
+                self.send_reddit_post,
+                name=str(doc['chat_id']),
+                context={
+                    'chat_id': doc['chat_id'],
+                    'channel': self.reddit.subreddit(doc['subreddit']),
+                    'limit': doc['limit'],
+                    'interval': doc['interval'],
+                },
+                interval=doc['interval'],
+                # Don't send everything at once after a restart
+                first=random.uniform(10, max(doc['interval'], 10))
+            )
+            if doc.get('paused'):
+                job.enabled = False
+                self.paused_chats.add(str(doc['chat_id']))
+        self.capacity.load(docs)
+        self.log.info(f"Scheduled {len(docs)} stored subscriptions")
+
+    def _drop_partition(self, partition: int) -> None:
+        '''Remove scheduled jobs of the lost partition
+        :param: partition: partition number
+        '''
+        with self._partitions_lock:
+            for job in self._partition_jobs.pop(partition, {}).values():
+                job.schedule_removal()
+
+    @applog
+    def compact_archive(self, context: CallbackContext) -> None:
+        '''Drop archived posts older than ARCHIVE_MAX_AGE
+        :param: context: telegram.ext.CallbackContext object
+        '''
+        deleted = self.archive.compact(
+            self.cfg.get('ARCHIVE_MAX_AGE', self.default_archive_max_age)
+        )
+        self.log.info(f"Dropped {deleted} archived posts")
+
+    def _observe_job_lag(self, event) -> None:
+        '''Scheduler listener, observes delay between scheduled
+        and actual fire time of the job
+        :param: event: apscheduler.events.JobSubmissionEvent
+        '''
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for run_time in event.scheduled_run_times:
+            JOB_LAG_SECONDS.observe((now - run_time).total_seconds())
+
+    def _register_metrics(self, job_queue) -> None:
+        '''Register scrape-time gauges and start metrics endpoint
+        :param: job_queue: telegram.ext.JobQueue object
+        '''
+        QUEUE_DEPTH.set_function(lambda: len(self.retries), queue="retry")
+        QUEUE_DEPTH.set_function(lambda: len(job_queue.jobs()), queue="jobs")
+        ACTIVE_SUBSCRIPTIONS.set_function(lambda: sum(
+            1 for x in job_queue.jobs()
+            if x.callback == self.send_reddit_post and x.enabled
+        ))
+        for resource in (REDDIT, TELEGRAM):
+            CAPACITY_PROJECTED.set_function(
+                lambda resource=resource: self.capacity.usage()[resource], resource=resource
+            )
+            CAPACITY_UTILIZATION.set_function(
+                lambda resource=resource: self.capacity.utilization()[resource], resource=resource
+            )
+        job_queue.scheduler.add_listener(self._observe_job_lag, EVENT_JOB_SUBMITTED)
+
+        port = self.cfg.get('METRICS_PORT', self.default_metrics_port)
+        if port:
+            self.log.info(f"Serving metrics on 127.0.0.1:{port}/metrics")
+            start_metrics_server(port)
+
+    @applog
+    def pause_chat(self, context: CallbackContext, chat_id: int) -> None:
+        '''Disable all subscriptions of the chat which can't
+        receive posts anymore (bot blocked, chat deleted...)
+        :param: context: telegram.ext.CallbackContext object
+        :param: chat_id: chat_id
+        '''
+        for job in context.job_queue.get_jobs_by_name(str(chat_id)):
+            job.enabled = False
+        self.paused_chats.add(str(chat_id))
+        self.capacity.set_paused(chat_id, True)
+        if self.store:
+            self.store.set_paused(chat_id, True)
+        self.log.info(f"Subscriptions of chat_id {chat_id} are paused")
+
+    @applog
+    def migrate_chat(self, context: CallbackContext, chat_id: int, new_chat_id: int) -> None:
+        '''Move subscriptions of the group upgraded to a supergroup
+        to its new chat_id
+        :param: context: telegram.ext.CallbackContext object
+        :param: chat_id: old chat_id
+        :param: new_chat_id: new chat_id
+        '''
+        old, new = str(chat_id), str(new_chat_id)
+        if self.store:
+            self.store.migrate(chat_id, new_chat_id)
+        if self.leases:
+            with self._partitions_lock:
+                for jobs in self._partition_jobs.values():
+                    for key in [x for x in jobs if str(x[0]) == old]:
+                        jobs.pop(key).schedule_removal()
+            partition = partition_of(new_chat_id, self.leases.partitions)
+            if self.leases.owns(partition):
+                self._load_partitions(context.job_queue, {partition})
+        else:
+            for job in context.job_queue.get_jobs_by_name(old):
+                job.schedule_removal()
+                context.job_queue.run_repeating(
+                    job.callback,
+                    name=new,
+                    context={**job.context, 'chat_id': new_chat_id},
+                    interval=job.context['interval'],
+                    first=10
+                )
+        if old in self.digest_chats:
+            self.digest_chats.discard(old)
+            self.digest_chats.add(new)
+        self.paused_chats.discard(old)
+        self.capacity.migrate(chat_id, new_chat_id)
+        self.log.info(f"Subscriptions of chat_id {chat_id} moved to chat_id {new_chat_id}")
+
+    @applog
+    def resume_chat(self, context: CallbackContext, chat_id: int) -> None:
+        '''Enable paused subscriptions of the chat
+        :param: context: telegram.ext.CallbackContext object
+        :param: chat_id: chat_id
+        '''
+        for job in context.job_queue.get_jobs_by_name(str(chat_id)):
+            job.enabled = True
+        self.paused_chats.discard(str(chat_id))
+        self.capacity.set_paused(chat_id, False)
+        if self.store:
+            self.store.set_paused(chat_id, False)
+        self.log.info(f"Subscriptions of chat_id {chat_id} are resumed")
+
+    def _render_payload(self, post: praw.models.Submission) -> Payload:
+        '''Pick the media kind of the reddit submission and
+        render its MarkdownV2 caption
+        :param: post: reddit submission (praw.models.Submissions)
+        '''
+        caption = self.caption.format(
+            title=escape_markdown(post.title, version=2),
+            likes=escape_markdown(str(post.ups), version=2),
+            coms=escape_markdown(str(post.num_comments), version=2)
         )
+        preview = getattr(post, "preview", None) or {}
+        media = getattr(post, "media", None) or {}
+
+        # Link posts (youtube and other oembed media) have no reddit video,
+        # they fall back to the post url like archived posts do
+        video = media.get('reddit_video') or preview.get('reddit_video_preview')
+        if video:
+            return Payload("video" if media else "animation", video['fallback_url'], caption)
 
-        self.log.debug("Photo sent")
+        return Payload("photo", post.url, caption)
 
     @applog
     def get_reddit_channel_by_name(self, name: str) -> praw.reddit.Subreddit:
         '''Validate channel name provided by user
         :param: name: name of the channel
         '''
-        channels = self.reddit.subreddits.search_by_name(name)
+        with REDDIT_REQUEST_SECONDS.time(endpoint="search_by_name"):
+            channels = self.reddit.subreddits.search_by_name(name)
         if not channels:
-            ChannelNotFoundError()
+            raise ChannelLookupError(f"Channel {name} not found")
         return channels[0]
 
     @applog
@@ -363,6 +1262,9 @@ class Bot(object):
         :param: context: telegram.ext.CallbackContext object
         '''
         text = self.help_md
+        if update.effective_chat and str(update.effective_chat.id) in self.paused_chats:
+            self.resume_chat(context, update.effective_chat.id)
+
         query = update.callback_query
         if query:
             query.answer()
@@ -402,14 +1304,18 @@ class Bot(object):
         :param: update: telegram.Update object
         :param: context: telegram.ext.CallbackContext object
         '''
-        items = [x.display_name for x in self.get_popular_subreddits()]
         query = update.callback_query
         query.answer()
-        query.edit_message_text(
-            text="Choose the channel ypu wanna subscribe on",
-            reply_markup=self._get_top_channels_kb(items)
-        )
 
+        def show_channels(channels):
+            items = [x.display_name for x in channels]
+            query.edit_message_text(
+                text="Choose the channel ypu wanna subscribe on",
+                reply_markup=self._get_top_channels_kb(items)
+            )
+
+        if not self._run_blocking(update, self.get_popular_subreddits, on_done=show_channels):
+            return ConversationHandler.END
         return self.TOP_LIMIT
 
     @applog
@@ -432,7 +1338,7 @@ class Bot(object):
         :param: context: telegram.ext.CallbackContext object
         '''
         query = update.callback_query
-        context.user_data["channel"] = query.data
+        context.user_data["top_channel"] = query.data
         query.answer()
         query.edit_message_text(
             text=self.questions["limit"],
@@ -491,15 +1397,22 @@ class Bot(object):
         '''
         query = update.callback_query
         context.user_data["timerange"] = query.data
-        channel = self.get_reddit_channel_by_name(context.user_data["channel"])
+        limit = int(context.user_data['limit'])
+        # hours to minutes
+        timerange = int(context.user_data['timerange']) * 60
 
-        self.subscribe_on_reddit_channel(
+        self._run_blocking(
             update,
-            context,
-            channel,
-            int(context.user_data['limit']) * 60,
-            int(context.user_data['timerange']),
-            chat_id=query.message.chat_id
+            self.get_reddit_channel_by_name,
+            context.user_data["top_channel"],
+            on_done=lambda channel: self.subscribe_on_reddit_channel(
+                update,
+                context,
+                channel,
+                limit,
+                timerange,
+                chat_id=query.message.chat_id
+            )
         )
 
         return ConversationHandler.END
@@ -574,11 +1487,26 @@ class Bot(object):
         :param: context: telegram.ext.CallbackContext object
         '''
         text = update.message.text
-        channel = self.get_reddit_channel_by_name(text)
-        context.user_data['channel'] = channel
-        user = update.message.from_user
-        update.message.reply_text(self.questions["limit"])
+        context.user_data.pop('channel', None)
+        context.user_data['channel_failed'] = False
+
+        def ask_limit(channel):
+            context.user_data['channel'] = channel
+            update.message.reply_text(self.questions["limit"])
 
+        def lookup_failed(e):
+            context.user_data['channel_failed'] = True
+
+        if not self._run_blocking(
+            update,
+            self.get_reddit_channel_by_name,
+            text,
+            on_done=ask_limit,
+            on_failure=lookup_failed
+        ):
+            return self.SUBREDDIT
+        # The conversation moves on before the lookup finishes, until
+        # it succeeds limit_helper takes messages as channel names
         return self.LIMIT
 
     @applog
@@ -591,7 +1519,16 @@ class Bot(object):
         :param: update: telegram.Update object
         :param: context: telegram.ext.CallbackContext object
         '''
+        if not context.user_data.get('channel'):
+            if context.user_data.get('channel_failed'):
+                return self.subreddit_helper(update, context)
+            update.message.reply_text(self.channel_pending_text)
+            return self.LIMIT
+
         text = update.message.text
+        if not text.strip().isdigit():
+            update.message.reply_text(self.number_expected_text)
+            return self.LIMIT
         context.user_data['limit'] = text
         user = update.message.from_user
         update.message.reply_text(self.questions["timerange"])
@@ -610,14 +1547,20 @@ class Bot(object):
         '''
         user = update.message.from_user
         text = update.message.text
+        if not text.strip().isdigit():
+            update.message.reply_text(self.number_expected_text)
+            return self.TIMERANGE
         context.user_data['timerange'] = text
+        if not context.user_data.get('channel'):
+            update.message.reply_text(self.reddit_error_text)
+            return ConversationHandler.END
 
         self.subscribe_on_reddit_channel(
             update,
             context,
             context.user_data['channel'],
-            int(context.user_data['limit'] * 60 * 60),
-            int(context.user_data['timerange'])
+            int(context.user_data['limit']),
+            int(context.user_data['timerange']) * 60
         )
 
         return ConversationHandler.END
@@ -633,7 +1576,7 @@ class Bot(object):
         :param: context: telegram.ext.CallbackContext object
         '''
         user = update.message.from_user
-        logger.info("User %s canceled the conversation.", user.first_name)
+        self.log.info(f"User {user.first_name} canceled the conversation.")
         update.message.reply_text(
             'Bye! I hope we can talk again some day.',
             reply_markup=ReplyKeyboardRemove()
@@ -641,19 +1584,18 @@ class Bot(object):
 
         return ConversationHandler.END
 
-    def run(self):
-        '''Run the application, register all bot handlers.
+    def register_handlers(self, dispatcher: Dispatcher) -> None:
+        '''Register all bot handlers.
+        :param: dispatcher: telegram.ext.Dispatcher object
         '''
-        self.log.info("Starting updater")
-        updater = Updater(self.cfg['TOKEN'], use_context=True)
-
-        self.log.info("Starting dispatcher")
-        dispatcher = updater.dispatcher
-
         self.log.info("Registering main handlers")
         dispatcher.add_handler(CommandHandler("start", self.show_help))
         dispatcher.add_handler(CommandHandler("sub", self.subscribe_on_reddit))
         dispatcher.add_handler(CommandHandler("show", self.show_posts))
+        dispatcher.add_handler(CommandHandler("digest", self.set_digest))
+        dispatcher.add_handler(CommandHandler("profile", self.start_profiling))
+        dispatcher.add_handler(CommandHandler("capacity", self.show_capacity))
+        dispatcher.add_handler(InlineQueryHandler(self.answer_inline_query))
 
 
         self.log.info("Registering callbacks for menu items")
@@ -695,7 +1637,84 @@ class Bot(object):
         )
         dispatcher.add_handler(helper_conv_handler)
 
-        self.log.info("Starting polling")
-        updater.start_polling()
+    def register_jobs(self, job_queue: JobQueue) -> None:
+        '''Register all bot background jobs.
+        :param: job_queue: telegram.ext.JobQueue object
+        '''
+        if self.store:
+            self.log.info("Loading digest mode of chats")
+            self.digest_chats.update(str(x) for x in self.store.digest_chats())
+            if not self.leases:
+                # Cluster instances schedule them by partitions in sync_partitions
+                self.log.info("Scheduling stored subscriptions")
+                self._load_subscriptions(job_queue)
+
+        self.log.info("Registering listings prefetch job")
+        interval = self.cfg.get('PREFETCH_INTERVAL', self.default_prefetch_interval)
+        job_queue.run_repeating(
+            self.prefetch_due_listings,
+            interval=interval,
+            first=interval
+        )
+
+        if self.archive:
+            self.log.info("Registering archive compaction job")
+            job_queue.run_repeating(
+                self.compact_archive,
+                interval=self.default_archive_compact_interval,
+                first=self.default_archive_compact_interval
+            )
+
+        self.log.info("Registering failed deliveries retry job")
+        interval = self.cfg.get('RETRY_INTERVAL', self.default_retry_interval)
+        job_queue.run_repeating(
+            self.retry_failed_deliveries,
+            interval=interval,
+            first=interval
+        )
+
+        self.log.info("Registering metrics")
+        self._register_metrics(job_queue)
+
+        if self.leases:
+            self.log.info(f"Joining cluster as {self.leases.instance_id}")
+            heartbeat = self.cfg.get('CLUSTER_HEARTBEAT', self.default_cluster_heartbeat)
+            job_queue.run_repeating(self.sync_partitions, interval=heartbeat, first=0)
 
-        updater.idle()
+    def run(self):
+        '''Run the application, register all bot handlers.
+        '''
+        self.log.info("Starting updater")
+        updater = Updater(self.cfg['TOKEN'], use_context=True)
+
+        self.log.info("Starting dispatcher")
+        dispatcher = updater.dispatcher
+        self.register_handlers(dispatcher)
+        self.register_jobs(updater.job_queue)
+
+        recorder = None
+        if self.cfg.get('RECORD_PATH'):
+            self.log.info(f"Recording updates and API calls to {self.cfg['RECORD_PATH']}")
+            recorder = UpdateRecorder(self.cfg['RECORD_PATH'])
+            recorder.attach(dispatcher)
+
+        # Telegram allows a single getUpdates consumer, in cluster
+        # mode other instances only run subscriptions
+        if self.cfg.get('POLL_UPDATES', True):
+            self.log.info("Starting polling")
+            updater.start_polling()
+            updater.idle()
+        else:
+            self.log.info("Updates polling is disabled, running jobs only")
+            updater.job_queue.start()
+            stop = threading.Event()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda *args: stop.set())
+            stop.wait()
+            updater.job_queue.stop()
+
+        if recorder:
+            recorder.close()
+        if self.leases:
+            self.log.info("Leaving cluster")
+            self.leases.shutdown()
@@ -0,0 +1,71 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache(object):
+    """Thread-safe in-memory cache with per-entry expiration
+    and LRU eviction once max_size is reached.
+    :param: ttl: time to live of an entry in seconds
+    :param: max_size: max number of entries to keep (0 - unlimited)
+    """
+
+    def __init__(self, ttl: float, max_size: int = 0) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        '''Return cached value or default if it's missing or expired
+        :param: key: cache key
+        :param: default: value to return on miss
+        '''
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        '''Put value to the cache
+        :param: key: cache key
+        :param: value: value to store
+        :param: ttl: custom time to live for this entry
+        '''
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            if self.max_size and len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        '''Remove the entry and return its value
+        :param: key: cache key
+        '''
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def evict_expired(self) -> int:
+        '''Drop all expired entries, returns number of dropped entries
+        '''
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, (exp, _) in self._data.items() if exp < now]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
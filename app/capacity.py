@@ -0,0 +1,239 @@
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Tuple, Union
+
+ACCEPT, CLAMP, COARSEN, REJECT = "accept", "clamp", "coarsen", "reject"
+
+REDDIT, TELEGRAM = "reddit", "telegram"
+
+HOUR = 3600
+
+
+class Subscription(NamedTuple):
+    """Active subscription as seen by the capacity model
+    :param: chat_id: chat_id
+    :param: subreddit: subreddit name
+    :param: limit: number of posts per run
+    :param: interval: interval in seconds
+    """
+    chat_id: str
+    subreddit: str
+    limit: int
+    interval: float
+
+
+class Decision(NamedTuple):
+    """Admission decision of a new subscription
+    :param: action: accept, clamp, coarsen or reject
+    :param: limit: admitted number of posts per run
+    :param: interval: admitted interval in seconds
+    :param: reason: human readable explanation of the adjustment
+    """
+    action: str
+    limit: int
+    interval: float
+    reason: str = ""
+
+    @property
+    def accepted(self) -> bool:
+        return self.action != REJECT
+
+
+class CapacityModel(object):
+    """Projects the load of the active subscription set on the reddit
+    quota and telegram send limits, and admits new subscriptions
+    within the budget.
+
+    Reddit calls are projected per subreddit at its fastest subscription
+    interval, but not faster than the listing cache ttl (subscriptions of
+    one subreddit share the cached listing). Combined prefetch requests
+    make it an upper bound. Telegram sends are limit posts per interval
+    of every subscription.
+
+    :param: reddit_calls_per_hour: reddit requests budget
+    :param: telegram_sends_per_hour: telegram messages budget
+    :param: user_sends_per_hour: telegram messages budget of a chat
+    :param: max_subscriptions: max number of subscriptions of a chat
+    :param: min_interval: shortest subscription interval in seconds
+    :param: max_interval: longest interval a subscription is coarsened to
+    :param: max_limit: max number of posts per run
+    :param: listing_ttl: seconds fetched listings are cached for
+    """
+
+    def __init__(
+        self,
+        reddit_calls_per_hour: float = 3000,
+        telegram_sends_per_hour: float = 54000,
+        user_sends_per_hour: float = 120,
+        max_subscriptions: int = 20,
+        min_interval: float = 300,
+        max_interval: float = 86400,
+        max_limit: int = 10,
+        listing_ttl: float = 300
+    ) -> None:
+        self.budget = {REDDIT: reddit_calls_per_hour, TELEGRAM: telegram_sends_per_hour}
+        self.user_sends_per_hour = user_sends_per_hour
+        self.max_subscriptions = max_subscriptions
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_limit = max_limit
+        self.listing_ttl = listing_ttl
+        self._subscriptions: Dict[Tuple[str, str], Subscription] = {}
+        self._paused = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(chat_id: Union[int, str], subreddit: str) -> Tuple[str, str]:
+        return str(chat_id), subreddit.lower()
+
+    def _active(self) -> List[Subscription]:
+        return [x for x in self._subscriptions.values() if x.chat_id not in self._paused]
+
+    def _reddit_rates(self, subscriptions: Iterable[Subscription]) -> Dict[str, float]:
+        intervals: Dict[str, float] = {}
+        for sub in subscriptions:
+            intervals[sub.subreddit] = min(intervals.get(sub.subreddit, sub.interval), sub.interval)
+        return {k: HOUR / max(v, self.listing_ttl) for k, v in intervals.items()}
+
+    @staticmethod
+    def _sends(subscriptions: Iterable[Subscription]) -> float:
+        return sum(x.limit * HOUR / x.interval for x in subscriptions)
+
+    def usage(self) -> Dict[str, float]:
+        '''Projected reddit calls and telegram sends per hour
+        of the active subscriptions
+        '''
+        with self._lock:
+            active = self._active()
+        return {
+            REDDIT: sum(self._reddit_rates(active).values()),
+            TELEGRAM: self._sends(active),
+        }
+
+    def utilization(self) -> Dict[str, float]:
+        '''Projected usage as a fraction of the budget, by resource
+        '''
+        return {k: v / self.budget[k] for k, v in self.usage().items()}
+
+    def admit(
+        self,
+        chat_id: Union[int, str],
+        subreddit: str,
+        limit: int,
+        interval: float
+    ) -> Decision:
+        '''Decide if the subscription fits in the budget. The limit is
+        clamped to max_limit, the interval is coarsened until the chat,
+        telegram and reddit budgets hold (up to max_interval), otherwise
+        the subscription is rejected. Replacing an existing subscription
+        of the chat to the same subreddit doesn't count twice.
+        :param: chat_id: chat_id
+        :param: subreddit: subreddit name
+        :param: limit: requested number of posts per run
+        :param: interval: requested interval in seconds
+        '''
+        if not limit or limit < 1 or not interval or interval <= 0:
+            return Decision(REJECT, limit, interval, "number of posts and interval must be positive")
+
+        key = self._key(chat_id, subreddit)
+        reasons = []
+        action = ACCEPT
+        if limit > self.max_limit:
+            limit, action = self.max_limit, CLAMP
+            reasons.append(f"limited to {limit} posts")
+
+        needed = max(interval, self.min_interval)
+        with self._lock:
+            others = [x for k, x in self._subscriptions.items() if k != key]
+            own = [x for x in others if x.chat_id == key[0]]
+            if len(own) >= self.max_subscriptions:
+                return Decision(REJECT, limit, interval, f"at most {self.max_subscriptions} subscriptions per chat")
+
+            active = [x for x in others if x.chat_id not in self._paused]
+            # Sends budget left for this subscription, for the chat and globally
+            for budget, used in (
+                (self.user_sends_per_hour, self._sends(x for x in own if x.chat_id not in self._paused)),
+                (self.budget[TELEGRAM], self._sends(active)),
+            ):
+                left = budget - used
+                if left <= 0:
+                    return Decision(REJECT, limit, interval, "send budget is exhausted")
+                needed = max(needed, limit * HOUR / left)
+
+            # Reddit budget only matters if the subreddit is fetched more often
+            rates = self._reddit_rates(active)
+            current = rates.pop(key[1], 0)
+            allowed = max(self.budget[REDDIT] - sum(rates.values()), current)
+            if HOUR / max(needed, self.listing_ttl) > allowed:
+                if allowed <= 0:
+                    return Decision(REJECT, limit, interval, "reddit budget is exhausted")
+                needed = max(needed, HOUR / allowed)
+
+        if needed > self.max_interval:
+            return Decision(REJECT, limit, interval, "the budget is exhausted")
+        if needed > interval:
+            interval, action = needed, COARSEN
+            reasons.append(f"interval set to {interval / 60:.0f} minutes")
+        return Decision(action, limit, interval, ", ".join(reasons))
+
+    def add(
+        self,
+        chat_id: Union[int, str],
+        subreddit: str,
+        limit: int,
+        interval: float
+    ) -> None:
+        '''Add or replace the active subscription
+        :param: chat_id: chat_id
+        :param: subreddit: subreddit name
+        :param: limit: number of posts per run
+        :param: interval: interval in seconds
+        '''
+        key = self._key(chat_id, subreddit)
+        with self._lock:
+            self._subscriptions[key] = Subscription(key[0], key[1], int(limit), float(interval))
+
+    def remove(self, chat_id: Union[int, str]) -> None:
+        '''Remove all subscriptions of the chat
+        :param: chat_id: chat_id
+        '''
+        with self._lock:
+            for key in [x for x in self._subscriptions if x[0] == str(chat_id)]:
+                del self._subscriptions[key]
+            self._paused.discard(str(chat_id))
+
+    def migrate(self, chat_id: Union[int, str], new_chat_id: Union[int, str]) -> None:
+        '''Move subscriptions of the chat to its new chat_id
+        :param: chat_id: old chat_id
+        :param: new_chat_id: new chat_id
+        '''
+        old, new = str(chat_id), str(new_chat_id)
+        with self._lock:
+            for key in [x for x in self._subscriptions if x[0] == old]:
+                self._subscriptions[(new, key[1])] = self._subscriptions.pop(key)._replace(chat_id=new)
+            self._paused.discard(old)
+
+    def set_paused(self, chat_id: Union[int, str], paused: bool) -> None:
+        '''Exclude (or include back) subscriptions of the chat from the load
+        :param: chat_id: chat_id
+        :param: paused: new state
+        '''
+        with self._lock:
+            if paused:
+                self._paused.add(str(chat_id))
+            else:
+                self._paused.discard(str(chat_id))
+
+    def load(self, docs: Iterable[Dict]) -> None:
+        '''Replace the subscription set with stored subscriptions
+        :param: docs: subscription documents (app.store.SUBSCRIPTION_FIELDS)
+        '''
+        subscriptions = {}
+        paused = set()
+        for doc in docs:
+            key = self._key(doc['chat_id'], doc['subreddit'])
+            subscriptions[key] = Subscription(key[0], key[1], int(doc['limit']), float(doc['interval']))
+            if doc.get('paused'):
+                paused.add(key[0])
+        with self._lock:
+            self._subscriptions = subscriptions
+            self._paused = paused
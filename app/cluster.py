@@ -0,0 +1,161 @@
+import os
+import math
+import time
+import zlib
+import socket
+from typing import Set, Tuple, Union
+
+import pymongo
+from pymongo.errors import DuplicateKeyError
+
+LEASES = "leases"
+INSTANCES = "instances"
+
+DEFAULT_PARTITIONS = 64
+
+
+def partition_of(chat_id: Union[int, str], partitions: int = DEFAULT_PARTITIONS) -> int:
+    '''Return partition of the chat subscriptions
+    :param: chat_id: chat_id
+    :param: partitions: total number of partitions
+    '''
+    return zlib.crc32(str(int(chat_id)).encode()) % partitions
+
+
+def fair_share(partitions: int, instances: int) -> int:
+    '''Max number of partitions a single instance should hold
+    :param: partitions: total number of partitions
+    :param: instances: number of live instances
+    '''
+    return math.ceil(partitions / max(instances, 1))
+
+
+class LeaseManager(object):
+    """Time-limited ownership of subscription partitions shared
+    by several bot instances through the database.
+    Every instance heartbeats, renews its leases and claims or
+    releases partitions to hold its fair share.
+    :param: db: pymongo database
+    :param: partitions: total number of partitions
+    :param: ttl: lease time to live in seconds
+    :param: instance_id: unique id of this instance
+    """
+
+    # A lease is treated as lost safety_margin seconds (up to
+    # max_safety_margin, a third of the ttl) before it expires, so a
+    # slow instance stops delivering before another one can claim
+    # the partition
+    max_safety_margin: float = 5
+
+    def __init__(
+        self,
+        db: pymongo.database.Database,
+        partitions: int = DEFAULT_PARTITIONS,
+        ttl: float = 30,
+        instance_id: str = None
+    ) -> None:
+        self.safety_margin = min(self.max_safety_margin, ttl / 3)
+        if ttl <= self.safety_margin:
+            raise ValueError(f"Lease ttl must be positive, got {ttl}")
+        self.leases = db[LEASES]
+        self.instances = db[INSTANCES]
+        self.partitions = partitions
+        self.ttl = ttl
+        self.instance_id = instance_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.owned: Set[int] = set()
+        self._valid_until = 0.0
+
+    def owns(self, partition: int) -> bool:
+        '''Check if this instance safely holds the partition
+        :param: partition: partition number
+        '''
+        return partition in self.owned and time.monotonic() < self._valid_until
+
+    def live_instances(self) -> int:
+        '''Number of instances with a fresh heartbeat
+        '''
+        return self.instances.count_documents({"expires_at": {"$gt": time.time()}})
+
+    def heartbeat(self) -> None:
+        '''Mark this instance alive and renew its leases
+        '''
+        started = time.monotonic()
+        expires_at = time.time() + self.ttl
+        self.instances.update_one(
+            {"_id": self.instance_id},
+            {"$set": {"expires_at": expires_at}},
+            upsert=True
+        )
+        self.leases.update_many(
+            {"owner": self.instance_id, "expires_at": {"$gt": time.time()}},
+            {"$set": {"expires_at": expires_at}}
+        )
+        self.owned = {
+            x["_id"] for x in self.leases.find(
+                {"owner": self.instance_id, "expires_at": {"$gt": time.time()}},
+                {"_id": True}
+            )
+        }
+        self._valid_until = started + self.ttl - self.safety_margin
+
+    def claim(self, partition: int) -> bool:
+        '''Claim the partition if it's free or its lease expired
+        :param: partition: partition number
+        '''
+        now = time.time()
+        try:
+            self.leases.find_one_and_update(
+                {"_id": partition, "$or": [
+                    {"owner": self.instance_id},
+                    {"expires_at": {"$lt": now}},
+                ]},
+                {"$set": {"owner": self.instance_id, "expires_at": now + self.ttl}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Somebody else holds the lease
+            return False
+        self.owned.add(partition)
+        return True
+
+    def release(self, partition: int) -> None:
+        '''Give the partition away
+        :param: partition: partition number
+        '''
+        self.owned.discard(partition)
+        self.leases.update_one(
+            {"_id": partition, "owner": self.instance_id},
+            {"$set": {"owner": None, "expires_at": 0}}
+        )
+
+    def rebalance(self) -> Tuple[Set[int], Set[int]]:
+        '''Heartbeat and claim or release partitions to hold
+        the fair share. Returns gained and lost partitions.
+        '''
+        before = set(self.owned)
+        self.heartbeat()
+        share = fair_share(self.partitions, self.live_instances())
+
+        if len(self.owned) > share:
+            for partition in sorted(self.owned)[share:]:
+                self.release(partition)
+        elif len(self.owned) < share:
+            # Start from an instance specific offset to avoid all
+            # instances competing for the same partitions
+            offset = zlib.crc32(self.instance_id.encode()) % self.partitions
+            for i in range(self.partitions):
+                partition = (offset + i) % self.partitions
+                if len(self.owned) >= share:
+                    break
+                if partition not in self.owned:
+                    self.claim(partition)
+
+        return self.owned - before, before - self.owned
+
+    def shutdown(self) -> None:
+        '''Release all leases and leave the cluster
+        '''
+        for partition in list(self.owned):
+            self.release(partition)
+        self.instances.delete_one({"_id": self.instance_id})
+        self._valid_until = 0.0
@@ -0,0 +1,136 @@
+import time
+import heapq
+import threading
+from itertools import count
+from typing import List, NamedTuple, Union
+
+from telegram.error import (
+    BadRequest,
+    ChatMigrated,
+    RetryAfter,
+    Unauthorized,
+)
+
+from app.payload import Payload
+
+RETRYABLE = "retryable"
+PERMANENT_CHAT = "permanent_chat"
+PERMANENT_MEDIA = "permanent_media"
+CHAT_MIGRATED = "chat_migrated"
+DROPPED = "dropped"
+
+# Substrings of telegram BadRequest messages (lowercased)
+CHAT_ERRORS = (
+    "chat not found",
+    "bot was blocked",
+    "bot was kicked",
+    "user is deactivated",
+    "have no rights to send",
+    "not enough rights",
+    "need administrator rights",
+)
+MEDIA_ERRORS = (
+    "wrong file identifier",
+    "wrong remote file",
+    "failed to get http url content",
+    "wrong type of the web page content",
+    "wrong http url",
+    "webpage_media_empty",
+    "webpage_curl_failed",
+    "file is too big",
+    "photo_invalid_dimensions",
+)
+
+
+def classify_error(error: Exception) -> str:
+    '''Classify failed send_* call.
+    Returns RETRYABLE, PERMANENT_CHAT, PERMANENT_MEDIA, CHAT_MIGRATED
+    (the group became a supergroup, see error.new_chat_id) or DROPPED
+    (unknown bad request, only this delivery is given up).
+    :param: error: exception raised by telegram.Bot
+    '''
+    if isinstance(error, ChatMigrated):
+        return CHAT_MIGRATED
+    if isinstance(error, Unauthorized):
+        return PERMANENT_CHAT
+    if isinstance(error, BadRequest):
+        message = error.message.lower()
+        if any(x in message for x in CHAT_ERRORS):
+            return PERMANENT_CHAT
+        if any(x in message for x in MEDIA_ERRORS):
+            return PERMANENT_MEDIA
+        # Caption or markup errors don't mean the media is bad
+        return DROPPED
+    return RETRYABLE
+
+
+class RetryItem(NamedTuple):
+    """Delivery of a rendered post to the chat.
+    :param: chat_id: chat_id to send a post
+    :param: payload: rendered post (app.payload.Payload)
+    :param: attempts: number of failed attempts
+    """
+    chat_id: Union[int, str]
+    payload: Payload
+    attempts: int = 0
+
+
+class RetryQueue(object):
+    """Bounded queue of failed deliveries with exponential backoff.
+    :param: max_size: max number of deliveries waiting for retry
+    :param: max_attempts: deliveries are dropped after this number of attempts
+    :param: backoff: delay of the first retry in seconds
+    :param: max_backoff: max delay between retries in seconds
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1000,
+        max_attempts: int = 5,
+        backoff: float = 5,
+        max_backoff: float = 600
+    ) -> None:
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._heap: List = []
+        self._seq = count()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def delay(self, item: RetryItem, error: Exception = None) -> float:
+        '''Return delay before the next attempt of the delivery
+        :param: item: failed delivery
+        :param: error: exception of the last attempt
+        '''
+        if isinstance(error, RetryAfter):
+            return float(error.retry_after)
+        return min(self.backoff * 2 ** (item.attempts - 1), self.max_backoff)
+
+    def push(self, item: RetryItem, error: Exception = None) -> bool:
+        '''Schedule the delivery for retry. Returns False if the
+        delivery is dropped (queue is full or attempts are exhausted)
+        :param: item: failed delivery
+        :param: error: exception of the last attempt
+        '''
+        if item.attempts >= self.max_attempts:
+            return False
+        due_at = time.monotonic() + self.delay(item, error)
+        with self._lock:
+            if len(self._heap) >= self.max_size:
+                return False
+            heapq.heappush(self._heap, (due_at, next(self._seq), item))
+        return True
+
+    def pop_due(self) -> List[RetryItem]:
+        '''Return all deliveries which are due for retry
+        '''
+        now = time.monotonic()
+        items = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                items.append(heapq.heappop(self._heap)[2])
+        return items
@@ -0,0 +1,52 @@
+import threading
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Union
+
+from app.payload import Payload
+
+
+class DigestEntry(NamedTuple):
+    """Post waiting in the chat digest.
+    :param: payload: rendered post (app.payload.Payload)
+    :param: subreddit: subreddit name
+    :param: title: post title
+    :param: url: link to the post
+    :param: likes: number of upvotes
+    :param: coms: number of comments
+    """
+    payload: Payload
+    subreddit: str
+    title: str
+    url: str
+    likes: int
+    coms: int
+
+
+class DigestBuffer(object):
+    """Per-chat buffer of posts of subscriptions which came due
+    within the digest window.
+    """
+
+    def __init__(self) -> None:
+        self._entries: Dict[str, List[DigestEntry]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def add(self, chat_id: Union[int, str], entry: DigestEntry) -> bool:
+        '''Add post to the chat digest. Returns True if it's the first
+        post of the digest (and the digest flush must be scheduled)
+        :param: chat_id: chat_id
+        :param: entry: post (DigestEntry)
+        '''
+        with self._lock:
+            entries = self._entries[str(chat_id)]
+            if any(x.payload.media == entry.payload.media for x in entries):
+                return False
+            entries.append(entry)
+            return len(entries) == 1
+
+    def pop(self, chat_id: Union[int, str]) -> List[DigestEntry]:
+        '''Take all buffered posts of the chat
+        :param: chat_id: chat_id
+        '''
+        with self._lock:
+            return self._entries.pop(str(chat_id), [])
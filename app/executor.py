@@ -0,0 +1,121 @@
+import time
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from app.metrics import QUEUE_DEPTH
+
+
+class ExecutorTimeoutError(Exception):
+    """Task waited in the queue for longer than its timeout"""
+
+
+class BlockingExecutor(object):
+    """Size-bounded thread pool for blocking (reddit) calls made by
+    interactive handlers, so dispatcher workers stay free for fast
+    callbacks. Limits number of pending tasks in total and per user.
+    :param: max_workers: number of threads
+    :param: max_pending: max number of queued and running tasks
+    :param: per_user: max number of queued and running tasks per user
+    :param: timeout: tasks which didn't start in timeout seconds are dropped
+    :param: name: name of the executor (used for threads and metrics)
+    :param: log: logger of errors nobody handled
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        max_pending: int = 100,
+        per_user: int = 2,
+        timeout: float = 30,
+        name: str = "reddit",
+        log: logging.Logger = None
+    ) -> None:
+        self.log = log or logging.getLogger(__name__)
+        self.max_pending = max_pending
+        self.per_user = per_user
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix=name)
+        self._pending: Dict[Hashable, int] = defaultdict(int)
+        self._total = 0
+        self._lock = threading.Lock()
+        # Called with (func, seconds since submit, exception or None) of every finished task
+        self.listeners: List[Callable[[Callable, float, Optional[Exception]], None]] = []
+        QUEUE_DEPTH.set_function(lambda: self._total, queue=f"{name}_executor")
+
+    @property
+    def pending(self) -> int:
+        '''Number of queued and running tasks
+        '''
+        return self._total
+
+    def submit(
+        self,
+        user_id: Hashable,
+        func: Callable,
+        *args: Any,
+        on_done: Callable[[Any], None] = None,
+        on_error: Callable[[Exception], None] = None,
+        **kwargs: Any
+    ) -> bool:
+        '''Run func(*args, **kwargs) in the pool and pass its result
+        to on_done. Exceptions raised by func or on_done are passed
+        to on_error, or logged if there's no on_error or it fails too.
+        Returns False if the task is rejected (executor or user is busy).
+        :param: user_id: id of the user the task runs for
+        :param: func: blocking function
+        :param: on_done: callback for the result
+        :param: on_error: callback for the exception
+        '''
+        with self._lock:
+            if self._total >= self.max_pending or self._pending[user_id] >= self.per_user:
+                return False
+            self._total += 1
+            self._pending[user_id] += 1
+
+        submitted = time.monotonic()
+        deadline = submitted + self.timeout
+
+        def run():
+            error = None
+            try:
+                if time.monotonic() > deadline:
+                    raise ExecutorTimeoutError(f"{func.__name__} waited longer than {self.timeout}s")
+                result = func(*args, **kwargs)
+                if on_done:
+                    on_done(result)
+            except Exception as e:
+                error = e
+                self._handle_error(func, e, on_error)
+            finally:
+                try:
+                    for listener in self.listeners:
+                        listener(func, time.monotonic() - submitted, error)
+                finally:
+                    with self._lock:
+                        self._total -= 1
+                        self._pending[user_id] -= 1
+                        if not self._pending[user_id]:
+                            del self._pending[user_id]
+
+        self._pool.submit(run)
+        return True
+
+    def _handle_error(
+        self,
+        func: Callable,
+        error: Exception,
+        on_error: Callable[[Exception], None] = None
+    ) -> None:
+        if on_error is None:
+            self.log.error(f"{func.__name__} failed: {error!r}", exc_info=error)
+            return
+        try:
+            on_error(error)
+        except Exception as e:
+            self.log.exception(f"Error handler of {func.__name__} failed: {e!r}")
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
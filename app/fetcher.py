@@ -0,0 +1,252 @@
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import praw
+
+from app.cache import TTLCache
+from app.archive import PostArchive
+from app.metrics import CACHE_REQUESTS, REDDIT_REQUEST_SECONDS
+
+
+class ListingCache(object):
+    """Cache of fetched subreddit listings.
+    Every entry keeps the fetched posts and a flag whether the listing
+    is exhausted (reddit has no more posts for the time filter), so
+    a short listing can still satisfy bigger limits.
+    :param: ttl: time to live of a listing in seconds
+    :param: max_size: max number of subreddits to keep
+    """
+
+    def __init__(self, ttl: float, max_size: int = 1000) -> None:
+        self._cache = TTLCache(ttl, max_size)
+
+    @staticmethod
+    def key(name: str) -> str:
+        return name.lower()
+
+    def get(self, name: str, limit: int) -> Optional[List[praw.models.Submission]]:
+        '''Return cached posts of the subreddit or None if the cache
+        can't satisfy the limit
+        :param: name: subreddit name
+        :param: limit: number of posts required
+        '''
+        entry = self._cache.get(self.key(name))
+        if entry is None or (len(entry[0]) < limit and not entry[1]):
+            CACHE_REQUESTS.inc(cache="listing", result="miss")
+            return None
+        CACHE_REQUESTS.inc(cache="listing", result="hit")
+        return entry[0][:limit]
+
+    def put(
+        self,
+        name: str,
+        posts: List[praw.models.Submission],
+        exhausted: bool = False
+    ) -> None:
+        '''Store listing of the subreddit
+        :param: name: subreddit name
+        :param: posts: list of posts in listing order
+        :param: exhausted: True if reddit has no more posts
+        '''
+        self._cache.set(self.key(name), (list(posts), exhausted))
+
+    def evict_expired(self) -> int:
+        '''Drop expired listings
+        '''
+        return self._cache.evict_expired()
+
+
+class RedditFetcher(object):
+    """Fetch layer for subreddit listings.
+    Packs several subreddits into combined `r/a+b+c` listings,
+    splits the results back per subreddit and keeps them in the
+    listing cache. With an archive, fetched posts are also stored
+    on disk and listings are served from it within archive_freshness.
+    Listeners are called with (name, posts, exhausted) of every fetched
+    listing of the default time filter.
+    :param: reddit: praw.Reddit client
+    :param: cache: ListingCache object
+    :param: log: logger
+    :param: archive: PostArchive object
+    :param: archive_freshness: max age of archived listings in seconds
+    """
+
+    time_filter: str = "day"
+
+    # Reddit never returns more than 100 items per listing request
+    max_listing_size: int = 100
+    # Max number of subreddits in a single combined listing
+    max_batch_size: int = 50
+    # Max length of the joined `a+b+c` part of the url
+    max_path_length: int = 1800
+
+    def __init__(
+        self,
+        reddit: praw.Reddit,
+        cache: ListingCache,
+        log: logging.Logger,
+        archive: PostArchive = None,
+        archive_freshness: float = 600
+    ) -> None:
+        self.reddit = reddit
+        self.cache = cache
+        self.log = log
+        self.archive = archive
+        self.archive_freshness = archive_freshness
+        self.listeners: List[Callable[[str, List[praw.models.Submission], bool], None]] = []
+
+    def pack(self, limits: Dict[str, int]) -> List[List[str]]:
+        '''Split subreddits into batches respecting url length,
+        number of subreddits and listing size limits.
+        :param: limits: subreddit name -> number of posts required
+        '''
+        batches: List[List[str]] = []
+        batch: List[str] = []
+        path_length = items = 0
+        for name in sorted(limits):
+            limit = min(int(limits[name]), self.max_listing_size)
+            extra = len(name) + (1 if batch else 0)
+            if batch and (
+                len(batch) >= self.max_batch_size
+                or path_length + extra > self.max_path_length
+                or items + limit > self.max_listing_size
+            ):
+                batches.append(batch)
+                batch, path_length, items = [], 0, 0
+                extra = len(name)
+            batch.append(name)
+            path_length += extra
+            items += limit
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def fetch_many(self, limits: Dict[str, int]) -> None:
+        '''Fetch listings of many subreddits using combined requests
+        and put them to the cache. Subreddits which didn't get enough
+        posts from the combined listing are fetched one by one.
+        :param: limits: subreddit name -> number of posts required
+        '''
+        limits = {
+            ListingCache.key(name): int(limit) for name, limit in limits.items()
+            if self.cache.get(name, int(limit)) is None and not self._archived(name, int(limit))
+        }
+        if not limits:
+            return
+
+        for batch in self.pack(limits):
+            if len(batch) == 1:
+                self._fetch_one(batch[0], limits[batch[0]])
+                continue
+
+            grouped, exhausted = self._fetch_combined(batch)
+            for name in batch:
+                posts = grouped.get(name, [])
+                if len(posts) >= limits[name] or exhausted:
+                    self._keep(name, posts, exhausted)
+                else:
+                    self._fetch_one(name, limits[name])
+
+    def top(
+        self,
+        channel: praw.models.Subreddit,
+        limit: int,
+        time_filter: str = None
+    ) -> List[praw.models.Submission]:
+        '''Return top posts of the subreddit, from cache or archive
+        if possible
+        :param: channel: subreddit (praw.models.Subreddit)
+        :param: limit: number of posts to return
+        :param: time_filter: reddit time filter (day by default)
+        '''
+        limit = int(limit)
+        time_filter = time_filter or self.time_filter
+        name = channel.display_name
+
+        if time_filter == self.time_filter:
+            posts = self.cache.get(name, limit)
+            if posts is not None:
+                return posts
+
+        if self.archive:
+            # Listings of the default time filter must be fresh, other
+            # ones are answered from whatever posts are archived
+            max_age = self.archive_freshness if time_filter == self.time_filter else None
+            posts = self.archive.top(name, limit, time_filter, max_age)
+            CACHE_REQUESTS.inc(cache="archive", result="miss" if posts is None else "hit")
+            if posts is not None:
+                return posts
+
+        return self._fetch_one(name, limit, channel, time_filter)
+
+    def _archived(self, name: str, limit: int) -> bool:
+        '''Check if archive has a fresh listing of the subreddit
+        :param: name: subreddit name
+        :param: limit: number of posts required
+        '''
+        if not self.archive:
+            return False
+        return self.archive.top(name, limit, self.time_filter, self.archive_freshness) is not None
+
+    def _keep(
+        self,
+        name: str,
+        posts: List[praw.models.Submission],
+        exhausted: bool,
+        time_filter: str = None
+    ) -> None:
+        '''Put fetched listing to the cache and archive
+        :param: name: subreddit name
+        :param: posts: fetched posts
+        :param: exhausted: True if reddit has no more posts
+        :param: time_filter: time filter of the listing
+        '''
+        time_filter = time_filter or self.time_filter
+        if time_filter == self.time_filter:
+            self.cache.put(name, posts, exhausted)
+            for listener in self.listeners:
+                listener(name, posts, exhausted)
+        if self.archive:
+            self.archive.store(name, posts, time_filter, exhausted)
+
+    def _fetch_combined(
+        self,
+        names: Iterable[str]
+    ) -> Tuple[Dict[str, List[praw.models.Submission]], bool]:
+        '''Fetch single combined listing, returns posts grouped by
+        subreddit and whether the combined listing is exhausted
+        :param: names: list of subreddit names
+        '''
+        path = "+".join(names)
+        self.log.debug(f"Fetching combined listing r/{path}")
+        with REDDIT_REQUEST_SECONDS.time(endpoint="top_combined"):
+            posts = list(self.reddit.subreddit(path).top(
+                time_filter=self.time_filter,
+                limit=self.max_listing_size
+            ))
+        grouped: Dict[str, List[praw.models.Submission]] = {}
+        for post in posts:
+            name = ListingCache.key(post.subreddit.display_name)
+            grouped.setdefault(name, []).append(post)
+        return grouped, len(posts) < self.max_listing_size
+
+    def _fetch_one(
+        self,
+        name: str,
+        limit: int,
+        channel: praw.models.Subreddit = None,
+        time_filter: str = None
+    ) -> List[praw.models.Submission]:
+        '''Fetch listing of a single subreddit and cache it
+        :param: name: subreddit name
+        :param: limit: number of posts to fetch
+        :param: channel: subreddit object, created from name if missing
+        :param: time_filter: reddit time filter (day by default)
+        '''
+        channel = channel or self.reddit.subreddit(name)
+        time_filter = time_filter or self.time_filter
+        self.log.debug(f"Fetching listing r/{name}, limit {limit}, time filter {time_filter}")
+        with REDDIT_REQUEST_SECONDS.time(endpoint="top"):
+            posts = list(channel.top(time_filter=time_filter, limit=limit))
+        self._keep(name, posts, len(posts) < limit, time_filter)
+        return posts
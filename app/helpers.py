@@ -1,6 +1,7 @@
 import yaml
 from functools import wraps
-from typing import Dict, Callable, Type
+from itertools import islice
+from typing import Dict, Callable, Iterable, Iterator, List, Type
 
 try:
     from yaml import CLoader as Loader
@@ -25,6 +26,10 @@ class ChannelNotFoundError(TelegramUserError):
         super().__init__(update, message)
 
 
+class ChannelLookupError(LookupError):
+    """Subreddit with the given name doesn't exist"""
+
+
 class IncorrectDareError(TelegramUserError):
     """docstring for FileNotFoundError"""
     def __call__(self, update):
@@ -52,3 +57,16 @@ def load_yaml(filepath: str) -> Dict:
     except yaml.YAMLError as exc:
         # TODO implement yaml error handling
         raise
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+    '''Split iterable into lists of the given size (the last one may be shorter).
+    :param: iterable: any iterable
+    :param: size: size of the batch
+    '''
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
@@ -0,0 +1,187 @@
+import re
+import time
+from urllib.parse import urlparse
+from typing import List, Optional, Tuple
+
+import praw
+from telegram import (
+    InlineQueryResult,
+    InlineQueryResultCachedMpeg4Gif,
+    InlineQueryResultCachedPhoto,
+    InlineQueryResultCachedVideo,
+    InlineQueryResultMpeg4Gif,
+    InlineQueryResultPhoto,
+    InlineQueryResultVideo,
+    Message,
+)
+from telegram.constants import PARSEMODE_MARKDOWN_V2
+
+from app.cache import TTLCache
+from app.fetcher import ListingCache
+from app.payload import Payload
+
+SUBREDDIT_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_]{1,20}$")
+
+# Telegram fetches photo results by url, only direct images work
+IMAGE_HOSTS = ("i.redd.it",)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+class RecentListings(object):
+    """In-memory listings the inline mode is answered from.
+    Entries outlive the listing cache, so a stale listing is still
+    served while a fresh one is fetched in background.
+    :param: ttl: time to live of a listing in seconds
+    :param: max_size: max number of subreddits to keep
+    :param: loading_ttl: seconds a background fetch is considered running
+    :param: max_posts: max number of posts kept per subreddit
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        max_size: int = 1000,
+        loading_ttl: float = 30,
+        max_posts: int = 100
+    ) -> None:
+        self.max_posts = max_posts
+        self._listings = TTLCache(ttl, max_size)
+        self._loading = TTLCache(loading_ttl)
+
+    def put(self, name: str, posts: List[praw.models.Submission], exhausted: bool = False) -> None:
+        '''Store the listing and mark its fetch as finished. A shorter
+        listing (fetched for a subscription) only refreshes the top
+        of the known one, unless reddit has no more posts.
+        :param: name: subreddit name
+        :param: posts: posts in listing order
+        :param: exhausted: True if reddit has no more posts
+        '''
+        key = ListingCache.key(name)
+        posts = list(posts)
+        entry = self._listings.get(key)
+        if entry is not None and not exhausted:
+            ids = {x.id for x in posts}
+            posts += [x for x in entry[0] if x.id not in ids]
+        self._listings.set(key, (posts[:self.max_posts], time.monotonic()))
+        self._loading.pop(key)
+
+    def get(self, name: str) -> Optional[Tuple[List[praw.models.Submission], float]]:
+        '''Return posts of the subreddit and their age in seconds,
+        None if the listing is unknown
+        :param: name: subreddit name
+        '''
+        entry = self._listings.get(ListingCache.key(name))
+        if entry is None:
+            return None
+        posts, fetched_at = entry
+        return posts, time.monotonic() - fetched_at
+
+    def start_loading(self, name: str) -> bool:
+        '''Mark the listing as being fetched. Returns False if
+        it's already being fetched
+        :param: name: subreddit name
+        '''
+        key = ListingCache.key(name)
+        if key in self._loading:
+            return False
+        self._loading.set(key, True)
+        return True
+
+    def stop_loading(self, name: str) -> None:
+        '''Forget that the listing is being fetched (the fetch
+        failed or was never started)
+        :param: name: subreddit name
+        '''
+        self._loading.pop(ListingCache.key(name))
+
+
+def parse_query(query: str) -> Optional[str]:
+    '''Return subreddit name of the inline query (`aww`, `r/aww`),
+    None if it's not a valid name
+    :param: query: inline query text
+    '''
+    name = query.strip().split(" ", 1)[0]
+    if name.lower().startswith("r/"):
+        name = name[2:]
+    return name if SUBREDDIT_NAME.match(name) else None
+
+
+def parse_offset(offset: str) -> int:
+    '''Return position of the requested page
+    :param: offset: inline query offset
+    '''
+    return int(offset) if offset.isdigit() else 0
+
+
+def sent_file_id(message: Message, kind: str) -> Optional[str]:
+    '''Return telegram file_id of the media sent in the message
+    :param: message: sent message
+    :param: kind: payload kind (photo, video, animation)
+    '''
+    if not isinstance(message, Message):
+        return None
+    if kind == "photo":
+        return message.photo[-1].file_id if message.photo else None
+    media = getattr(message, kind, None)
+    return media.file_id if media else None
+
+
+def is_image_url(url: str) -> bool:
+    '''Check if the url points to an image file, not to a link,
+    gallery or text post
+    :param: url: media url
+    '''
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https"):
+        return False
+    return parsed.netloc in IMAGE_HOSTS or parsed.path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def thumbnail(post: praw.models.Submission) -> Optional[str]:
+    '''Return thumbnail url of the post, if reddit made one
+    :param: post: reddit submission (praw.models.Submission)
+    '''
+    url = getattr(post, "thumbnail", None) or ""
+    return url if url.startswith("http") else None
+
+
+def inline_result(
+    post: praw.models.Submission,
+    payload: Payload,
+    file_id: str = None
+) -> Optional[InlineQueryResult]:
+    '''Make inline query result of the rendered post, using the media
+    already uploaded to telegram if its file_id is known.
+    Returns None if the post can't be shown inline.
+    :param: post: reddit submission (praw.models.Submission)
+    :param: payload: rendered post (app.payload.Payload)
+    :param: file_id: telegram file_id of the payload media
+    '''
+    common = dict(id=post.id, caption=payload.caption, parse_mode=PARSEMODE_MARKDOWN_V2)
+    if payload.kind == "photo":
+        if file_id:
+            return InlineQueryResultCachedPhoto(photo_file_id=file_id, **common)
+        # One bad photo url makes telegram reject the whole answer
+        if not is_image_url(payload.media):
+            return None
+        return InlineQueryResultPhoto(
+            photo_url=payload.media, thumb_url=thumbnail(post) or payload.media, **common
+        )
+    if payload.kind == "animation":
+        if file_id:
+            return InlineQueryResultCachedMpeg4Gif(mpeg4_file_id=file_id, **common)
+        return InlineQueryResultMpeg4Gif(
+            mpeg4_url=payload.media, thumb_url=payload.media, thumb_mime_type="video/mp4", **common
+        )
+    if payload.kind == "video":
+        title = post.title[:64]
+        if file_id:
+            return InlineQueryResultCachedVideo(video_file_id=file_id, title=title, **common)
+        # Telegram requires a jpeg thumbnail for videos sent by url
+        thumb = thumbnail(post)
+        if not thumb:
+            return None
+        return InlineQueryResultVideo(
+            video_url=payload.media, mime_type="video/mp4", thumb_url=thumb, title=title, **common
+        )
+    return None
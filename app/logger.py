@@ -2,6 +2,8 @@ import logging
 from typing import Type
 from functools import wraps
 
+from app.metrics import HANDLER_SECONDS
+
 default_handler = logging.StreamHandler()
 default_handler.setFormatter(
     logging.Formatter("[%(asctime)s] %(levelname)s in %(module)s: %(message)s")
@@ -25,7 +27,8 @@ def applog(func):
     @wraps(func)
     def wrap(self, *args, **kwargs):
         self.log.info(f"Starting {func.__name__} with parameters: args - {args}, kwargs = {kwargs}")
-        rse = func(self, *args, **kwargs)
+        with HANDLER_SECONDS.time(handler=func.__name__):
+            rse = func(self, *args, **kwargs)
         self.log.info(f"Finishing {func.__name__}")
         return rse
     return wrap
@@ -0,0 +1,276 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric(object):
+    """Base class of a metric with a fixed set of label names.
+    Label values are passed as keyword arguments.
+    :param: name: metric name
+    :param: documentation: help text
+    :param: labelnames: names of the metric labels
+    """
+
+    type: str = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(str(labels[x]) for x in self.labelnames)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        '''Yield (suffix, labels, value) samples of the metric
+        '''
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield "", _format_labels(self.labelnames, key), value
+
+    def expose(self) -> str:
+        '''Return metric in prometheus text format
+        '''
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {float(value)!r}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Monotonically increasing counter
+    """
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value which can go up and down, or be computed on every scrape
+    """
+
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._functions: Dict[Tuple, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, func: Callable[[], float], **labels: str) -> None:
+        '''Compute the value with func on every scrape
+        :param: func: function without arguments returning the value
+        '''
+        with self._lock:
+            self._functions[self._key(labels)] = func
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        yield from super().samples()
+        with self._lock:
+            functions = list(self._functions.items())
+        for key, func in functions:
+            try:
+                value = func()
+            except Exception:
+                continue
+            yield "", _format_labels(self.labelnames, key), value
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets
+    :param: buckets: upper bounds of the buckets
+    """
+
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # counts per bucket (+Inf is the last one), sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        '''Observe duration of the with block
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        with self._lock:
+            values = [(k, (list(v[0]), v[1])) for k, v in self._values.items()]
+        names = self.labelnames + ("le",)
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield "_bucket", _format_labels(names, key + (le,)), cumulative
+            labels = _format_labels(self.labelnames, key)
+            yield "_sum", labels, total
+            yield "_count", labels, cumulative
+
+
+class Registry(object):
+    """Collection of metrics exposed together
+    """
+
+    def __init__(self) -> None:
+        self._metrics: List[Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        '''Return all metrics in prometheus text format
+        '''
+        with self._lock:
+            metrics = list(self._metrics)
+        return "\n".join(x.expose() for x in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+REDDIT_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "telegag_reddit_request_seconds",
+    "Latency of reddit API requests",
+    ["endpoint"]
+))
+TELEGRAM_SEND_SECONDS = REGISTRY.register(Histogram(
+    "telegag_telegram_send_seconds",
+    "Latency of telegram send_* calls",
+    ["method", "outcome"]
+))
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    "telegag_handler_seconds",
+    "Latency of bot handlers and jobs",
+    ["handler"]
+))
+JOB_LAG_SECONDS = REGISTRY.register(Histogram(
+    "telegag_job_lag_seconds",
+    "Delay between scheduled and actual fire time of jobs",
+    buckets=(0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "telegag_cache_requests_total",
+    "Cache lookups by result (hit or miss)",
+    ["cache", "result"]
+))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "telegag_queue_depth",
+    "Number of items waiting in the queue",
+    ["queue"]
+))
+ACTIVE_SUBSCRIPTIONS = REGISTRY.register(Gauge(
+    "telegag_active_subscriptions",
+    "Number of enabled subscriptions"
+))
+CAPACITY_PROJECTED = REGISTRY.register(Gauge(
+    "telegag_capacity_projected_per_hour",
+    "Projected reddit calls and telegram sends per hour of active subscriptions",
+    ["resource"]
+))
+CAPACITY_UTILIZATION = REGISTRY.register(Gauge(
+    "telegag_capacity_utilization_ratio",
+    "Projected usage as a fraction of the budget",
+    ["resource"]
+))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the registry on /metrics
+    """
+
+    registry: Registry = REGISTRY
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.expose().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def start_metrics_server(
+    port: int,
+    host: str = "127.0.0.1",
+    registry: Registry = REGISTRY
+) -> ThreadingHTTPServer:
+    '''Serve /metrics endpoint in a daemon thread
+    :param: port: port to listen on
+    :param: host: address to bind
+    :param: registry: metrics registry to expose
+    '''
+    handler = type("MetricsHandler", (MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,61 @@
+from typing import Callable, NamedTuple
+
+import praw
+
+from app.cache import TTLCache
+from app.metrics import CACHE_REQUESTS
+
+
+class Payload(NamedTuple):
+    """Rendered outbound message of a reddit post.
+    :param: kind: media kind, matches telegram send_* method (photo, video, animation)
+    :param: media: url (or telegram file_id) of the media
+    :param: caption: MarkdownV2 escaped caption
+    """
+    kind: str
+    media: str
+    caption: str
+
+
+class PayloadCache(object):
+    """Cache of rendered payloads shared across all chats.
+    Entries are keyed by post id and a version (score rounded to
+    two significant digits), so a hot post is rendered once per
+    version and not once per recipient.
+    :param: ttl: time to live of a payload in seconds
+    :param: max_size: max number of payloads to keep
+    """
+
+    def __init__(self, ttl: float, max_size: int = 10000) -> None:
+        self._cache = TTLCache(ttl, max_size)
+
+    @staticmethod
+    def version(post: praw.models.Submission) -> int:
+        '''Return version of the post (rounded score)
+        :param: post: reddit submission (praw.models.Submission)
+        '''
+        return int(float(f"{post.ups:.2g}"))
+
+    def get(
+        self,
+        post: praw.models.Submission,
+        render: Callable[[praw.models.Submission], Payload]
+    ) -> Payload:
+        '''Return cached payload of the post, render it on miss
+        :param: post: reddit submission (praw.models.Submission)
+        :param: render: function to render a payload from the post
+        '''
+        key = (post.id, self.version(post))
+        payload = self._cache.get(key)
+        if payload is None:
+            CACHE_REQUESTS.inc(cache="payload", result="miss")
+            payload = render(post)
+            self._cache.set(key, payload)
+        else:
+            CACHE_REQUESTS.inc(cache="payload", result="hit")
+        return payload
+
+    def evict_expired(self) -> int:
+        '''Drop expired payloads
+        '''
+        return self._cache.evict_expired()
@@ -0,0 +1,180 @@
+import os
+import sys
+import time
+import threading
+import tracemalloc
+from collections import Counter
+from typing import List, Optional, Tuple
+
+Function = Tuple[str, int, str]
+
+# Leaf frames (file suffix, function) of threads blocked waiting:
+# locks, events, queues, selectors, sockets and pool workers
+IDLE_FRAMES = (
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("socket.py", "readinto"),
+    ("socket.py", "accept"),
+    ("ssl.py", "read"),
+    ("socketserver.py", "serve_forever"),
+    (os.path.join("concurrent", "futures", "thread.py"), "_worker"),
+)
+
+
+def is_idle(frame) -> bool:
+    '''Check if the innermost frame of a thread is a blocking wait
+    :param: frame: innermost frame of the thread
+    '''
+    code = frame.f_code
+    return any(code.co_name == name and code.co_filename.endswith(suffix) for suffix, name in IDLE_FRAMES)
+
+
+class SamplingProfiler(object):
+    """Stack sampling profiler of all threads of the process.
+    Unlike cProfile it sees handlers and jobs running in dispatcher
+    and job queue threads, and costs nothing while it's stopped.
+    Threads blocked waiting (idle workers, pollers) are not sampled,
+    percentages are of the sampling ticks, so a function busy in
+    one thread all the time is at 100%.
+    :param: interval: sampling interval in seconds
+    """
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.ticks = 0
+        self.samples = 0
+        self.idle = 0
+        self.cumulative: Counter = Counter()
+        self.own: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.ticks += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                if is_idle(frame):
+                    self.idle += 1
+                    continue
+                self.samples += 1
+                seen = set()
+                top = True
+                while frame is not None:
+                    code = frame.f_code
+                    func = (code.co_filename, code.co_firstlineno, code.co_name)
+                    if top:
+                        self.own[func] += 1
+                        top = False
+                    if func not in seen:
+                        seen.add(func)
+                        self.cumulative[func] += 1
+                    frame = frame.f_back
+
+    def report(self, limit: int = 40) -> str:
+        '''Return top functions by cumulative time
+        :param: limit: number of functions
+        '''
+        lines = [
+            f"{self.ticks} ticks every {self.interval * 1000:g}ms, "
+            f"{self.samples} busy thread samples ({self.idle} idle skipped)",
+            "",
+            f"{'cumtime':>10} {'cum%':>6} {'tottime':>10} {'tot%':>6}  function",
+        ]
+        total = max(self.ticks, 1)
+        for func, count in self.cumulative.most_common(limit):
+            own = self.own.get(func, 0)
+            filename, lineno, name = func
+            lines.append(
+                f"{count * self.interval:>9.2f}s {count * 100 / total:>5.1f}% "
+                f"{own * self.interval:>9.2f}s {own * 100 / total:>5.1f}%  "
+                f"{name} ({filename}:{lineno})"
+            )
+        return "\n".join(lines)
+
+
+class MemoryProfiler(object):
+    """tracemalloc based allocation profiler
+    :param: frames: number of frames stored per allocation
+    """
+
+    ignored = (tracemalloc.__file__, "<frozen importlib._bootstrap>", "<unknown>")
+
+    def __init__(self, frames: int = 10) -> None:
+        self.frames = frames
+        self._started_here = False
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_here = True
+
+    def stop(self) -> None:
+        self._snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, x) for x in self.ignored]
+        )
+        if self._started_here:
+            tracemalloc.stop()
+
+    def report(self, limit: int = 40) -> str:
+        '''Return top allocation sites of the memory traced
+        since start
+        :param: limit: number of allocation sites
+        '''
+        stats = self._snapshot.statistics("lineno")
+        total = sum(x.size for x in stats)
+        lines = [f"{total / 1024:.1f} KiB traced in {len(stats)} allocation sites", ""]
+        for stat in stats[:limit]:
+            frame = stat.traceback[0]
+            lines.append(
+                f"{stat.size / 1024:>10.1f} KiB {stat.count:>8} blocks  {frame.filename}:{frame.lineno}"
+            )
+        return "\n".join(lines)
+
+
+class ProfilingSession(object):
+    """Time-boxed run of CPU and/or memory profilers
+    :param: cpu: run the sampling profiler
+    :param: memory: trace memory allocations
+    """
+
+    def __init__(self, cpu: bool = True, memory: bool = True) -> None:
+        self.profilers: List = []
+        if cpu:
+            self.profilers.append(SamplingProfiler())
+        if memory:
+            self.profilers.append(MemoryProfiler())
+        self.started_at = 0.0
+
+    def start(self) -> None:
+        self.started_at = time.time()
+        for profiler in self.profilers:
+            profiler.start()
+
+    def stop(self) -> str:
+        '''Stop the profilers and return the report
+        '''
+        for profiler in self.profilers:
+            profiler.stop()
+        duration = time.time() - self.started_at
+        header = f"Profiled for {duration:.1f}s"
+        return "\n\n".join([header] + [x.report() for x in self.profilers]) + "\n"
@@ -0,0 +1,434 @@
+import gzip
+import json
+import time
+import random
+import threading
+from queue import Queue
+from collections import Counter
+from types import SimpleNamespace
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Sequence, Tuple
+
+from telegram import Bot as TelegramBot, Update
+from telegram.ext import Dispatcher, JobQueue, TypeHandler
+from telegram.utils.request import Request
+
+# Dispatcher groups of the replay markers, all bot handlers are in group 0
+FIRST_GROUP, LAST_GROUP = -100, 100
+
+STUB_TOKEN = "123456:stub-token"
+
+
+def _dumps(record: Dict) -> str:
+    return json.dumps(record, separators=(",", ":"), default=str)
+
+
+def percentiles(values: Sequence[float], points: Sequence[int] = (50, 95, 99)) -> Dict[str, float]:
+    '''Nearest-rank percentiles of the values
+    :param: values: measured values
+    :param: points: percentiles to compute
+    '''
+    ordered = sorted(values)
+    if not ordered:
+        return {f"p{x}": 0.0 for x in points}
+    result = {
+        f"p{x}": ordered[max(int(round(x / 100 * len(ordered))) - 1, 0)]
+        for x in points
+    }
+    result["max"] = ordered[-1]
+    return result
+
+
+class UpdateRecorder(object):
+    """Writes incoming updates and outgoing Bot API calls to
+    a gzipped JSON Lines log.
+    :param: path: log filename
+    """
+
+    def __init__(self, path: str) -> None:
+        self._file = gzip.open(path, "at")
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+
+    def write(self, record: Dict) -> None:
+        record["t"] = round(time.monotonic() - self._started, 4)
+        line = _dumps(record)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def record_update(self, update: Update, context) -> None:
+        self.write({"type": "update", "update": update.to_dict()})
+
+    def attach(self, dispatcher: Dispatcher) -> None:
+        '''Record updates handled by the dispatcher and API calls
+        made by its bot
+        :param: dispatcher: telegram.ext.Dispatcher object
+        '''
+        dispatcher.add_handler(TypeHandler(Update, self.record_update), group=FIRST_GROUP)
+
+        request = dispatcher.bot.request
+        post = request.post
+
+        def recorded_post(url, data, timeout=None):
+            start = time.perf_counter()
+            try:
+                return post(url, data, timeout)
+            finally:
+                self.write({
+                    "type": "call",
+                    "method": url.rsplit("/", 1)[-1],
+                    "data": data,
+                    "seconds": round(time.perf_counter() - start, 4),
+                })
+
+        request.post = recorded_post
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def load_updates(path: str) -> List[Tuple[float, Dict]]:
+    '''Read (time, update) pairs from a recorded log
+    :param: path: log filename
+    '''
+    with gzip.open(path, "rt") as stream:
+        records = (json.loads(x) for x in stream if x.strip())
+        return [(x["t"], x["update"]) for x in records if x["type"] == "update"]
+
+
+class StubRequest(Request):
+    """Telegram Bot API endpoint answering every call locally
+    :param: latency: simulated latency of a call in seconds
+    """
+
+    def __init__(self, latency: float = 0) -> None:
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_id = 0
+        self._lock = threading.Lock()
+
+    def _message(self, data: Dict) -> Dict:
+        with self._lock:
+            self._message_id += 1
+            message_id = self._message_id
+        chat_id = data.get("chat_id") or 1
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "text": data.get("text", ""),
+        }
+
+    def post(self, url: str, data: Dict, timeout: float = None):
+        method = url.rsplit("/", 1)[-1]
+        with self._lock:
+            self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        if method == "getMe":
+            return {"id": 123456, "is_bot": True, "first_name": "stub", "username": "stub_bot"}
+        if method.startswith(("send", "edit", "forward", "copy")):
+            message = self._message(data or {})
+            return [message] if method == "sendMediaGroup" else message
+        return True
+
+    def retrieve(self, url: str, timeout: float = None) -> bytes:
+        return b""
+
+
+class StubSubreddit(object):
+    def __init__(self, reddit: "StubReddit", name: str) -> None:
+        self.reddit = reddit
+        self.display_name = name
+
+    def top(self, time_filter: str = "day", limit: int = 10) -> Iterator:
+        self.reddit.wait()
+        for name in self.display_name.split("+"):
+            for i in range(min(int(limit), 25)):
+                yield SimpleNamespace(
+                    id=f"{name}{i}",
+                    title=f"Post {i} of r/{name}",
+                    ups=1000 - i,
+                    num_comments=i,
+                    url=f"https://i.redd.it/{name}{i}.jpg",
+                    created_utc=time.time() - i * 60,
+                    media=None,
+                    preview=None,
+                    subreddit=SimpleNamespace(display_name=name),
+                )
+
+
+class StubReddit(object):
+    """Reddit API answering every call locally
+    :param: latency: simulated latency of a request in seconds
+    """
+
+    popular_names = ("aww", "pics", "funny", "gifs", "videos")
+
+    def __init__(self, latency: float = 0) -> None:
+        self.latency = latency
+        self.subreddits = SimpleNamespace(
+            popular=self._popular,
+            search_by_name=self._search_by_name,
+        )
+
+    def wait(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def subreddit(self, name: str) -> StubSubreddit:
+        return StubSubreddit(self, name)
+
+    def _popular(self) -> Iterator[StubSubreddit]:
+        self.wait()
+        return iter([StubSubreddit(self, x) for x in self.popular_names])
+
+    def _search_by_name(self, name: str) -> List[StubSubreddit]:
+        self.wait()
+        return [StubSubreddit(self, name)]
+
+
+class UpdateFactory(object):
+    """Builds Update JSON of users talking to the bot
+    """
+
+    def __init__(self) -> None:
+        self.update_id = 0
+        self.message_id = 0
+
+    def _next(self) -> Tuple[int, int]:
+        self.update_id += 1
+        self.message_id += 1
+        return self.update_id, self.message_id
+
+    @staticmethod
+    def _user(user_id: int) -> Dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def message(self, user_id: int, text: str) -> Dict:
+        update_id, message_id = self._next()
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return {"update_id": update_id, "message": message}
+
+    def callback(self, user_id: int, data: str) -> Dict:
+        update_id, message_id = self._next()
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id),
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "menu",
+            },
+        }}
+
+
+def synthesize(users: int = 50, updates: int = 1000, seed: int = 0) -> List[Tuple[float, Dict]]:
+    '''Make a stream of realistic user sessions: menu, /show, /sub,
+    both subscription conversations and /cancel
+    :param: users: number of distinct users
+    :param: updates: approximate number of updates
+    :param: seed: random seed
+    '''
+    rnd = random.Random(seed)
+    factory = UpdateFactory()
+    subreddits = StubReddit.popular_names
+    sessions = [
+        lambda u, s: [factory.message(u, "/start")],
+        lambda u, s: [factory.message(u, f"/show {s} 3")],
+        lambda u, s: [factory.message(u, f"/show {s} 2 week")],
+        lambda u, s: [factory.message(u, f"/sub {s} 1 3")],
+        lambda u, s: [factory.message(u, "/start"), factory.callback(u, "show_help")],
+        lambda u, s: [
+            factory.callback(u, "categories"),
+            factory.callback(u, s),
+            factory.callback(u, "3"),
+            factory.callback(u, "4"),
+        ],
+        lambda u, s: [
+            factory.callback(u, "sub_helper"),
+            factory.message(u, s),
+            factory.message(u, "3"),
+            factory.message(u, "4"),
+        ],
+        lambda u, s: [factory.message(u, "/cancel")],
+    ]
+
+    stream: List[Tuple[float, Dict]] = []
+    t = 0.0
+    while len(stream) < updates:
+        user_id = rnd.randint(1, users) + 1000
+        for update in rnd.choice(sessions)(user_id, rnd.choice(subreddits)):
+            t += rnd.expovariate(100)
+            stream.append((round(t, 4), update))
+    return stream
+
+
+class ReplayReport(NamedTuple):
+    updates: int
+    errors: int
+    seconds: float
+    handler: Dict[str, float]
+    end_to_end: Dict[str, float]
+    calls: Dict[str, int]
+    background: Dict[str, float]
+    background_errors: int
+
+    @property
+    def throughput(self) -> float:
+        return self.updates / self.seconds if self.seconds else 0.0
+
+    def format(self) -> str:
+        def ms(stats):
+            return ", ".join(f"{k} {v * 1000:.2f}ms" for k, v in stats.items())
+
+        lines = [
+            f"updates: {self.updates} in {self.seconds:.2f}s ({self.throughput:.1f} updates/s), "
+            f"errors: {self.errors} ({self.background_errors} in background tasks)",
+            f"handler latency: {ms(self.handler)}",
+            f"end-to-end latency: {ms(self.end_to_end)}",
+            f"background task latency: {ms(self.background)}",
+            "api calls: " + ", ".join(f"{k} {v}" for k, v in sorted(self.calls.items())),
+        ]
+        return "\n".join(lines)
+
+
+class Replayer(object):
+    """Pushes a stream of updates through the bot handlers graph
+    against stubbed Telegram and Reddit endpoints, with subscription
+    store, cluster leases and post archive turned off, and measures
+    handler latency and latency of the reddit calls handlers
+    run in background (bot.reddit_executor).
+    :param: bot: app.bot.Bot object
+    :param: telegram_latency: simulated latency of Bot API calls
+    :param: reddit_latency: simulated latency of reddit requests
+    :param: workers: number of dispatcher async workers
+    """
+
+    def __init__(
+        self,
+        bot,
+        telegram_latency: float = 0,
+        reddit_latency: float = 0,
+        workers: int = 4
+    ) -> None:
+        self.app = bot
+        self.request = StubRequest(telegram_latency)
+        self.reddit = StubReddit(reddit_latency)
+        self.app.reddit = self.app.fetcher.reddit = self.reddit
+        # Replayed subscriptions and stub posts must not reach the real
+        # database and archive (or be scheduled by cluster instances)
+        self.app.store = self.app.leases = None
+        self.app.archive = self.app.fetcher.archive = None
+
+        self.job_queue = JobQueue()
+        self.dispatcher = Dispatcher(
+            TelegramBot(STUB_TOKEN, request=self.request),
+            Queue(),
+            workers=workers,
+            job_queue=self.job_queue
+        )
+        self.job_queue.set_dispatcher(self.dispatcher)
+        self.app.register_handlers(self.dispatcher)
+
+        self._enqueued: Dict[int, float] = {}
+        self._started: Dict[int, float] = {}
+        self._handler: List[float] = []
+        self._end_to_end: List[float] = []
+        self._errors = 0
+        self._background: List[float] = []
+        self._background_errors = 0
+        self._done = threading.Event()
+        self._expected = 0
+        self._lock = threading.Lock()
+
+        self.dispatcher.add_handler(TypeHandler(Update, self._on_start), group=FIRST_GROUP)
+        self.dispatcher.add_handler(TypeHandler(Update, self._on_finish), group=LAST_GROUP)
+        self.dispatcher.add_error_handler(self._on_error)
+        self.app.reddit_executor.listeners.append(self._on_task)
+
+    def _on_start(self, update: Update, context) -> None:
+        self._started[update.update_id] = time.perf_counter()
+
+    def _on_finish(self, update: Update, context) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            self._handler.append(now - self._started.pop(update.update_id))
+            self._end_to_end.append(now - self._enqueued.pop(update.update_id))
+            if len(self._handler) >= self._expected:
+                self._done.set()
+
+    def _on_error(self, update, context) -> None:
+        with self._lock:
+            self._errors += 1
+
+    def _on_task(self, func, seconds: float, error: Exception = None) -> None:
+        with self._lock:
+            self._background.append(seconds)
+            if error is not None:
+                self._background_errors += 1
+
+    def _wait_background(self, deadline: float) -> None:
+        '''Wait until reddit calls started by the handlers finish
+        :param: deadline: time.perf_counter() to give up at
+        '''
+        while self.app.reddit_executor.pending and time.perf_counter() < deadline:
+            time.sleep(0.005)
+
+    def run(
+        self,
+        updates: Iterable[Tuple[float, Dict]],
+        speed: float = 0,
+        timeout: float = 300
+    ) -> ReplayReport:
+        '''Replay the updates and return latency report
+        :param: updates: (time, update JSON) pairs
+        :param: speed: replay speed multiplier, 0 - as fast as possible
+        :param: timeout: max time to wait for the updates to be handled
+        '''
+        updates = [(t, Update.de_json(x, self.dispatcher.bot)) for t, x in updates]
+        self._expected = len(updates)
+        thread = threading.Thread(target=self.dispatcher.start, name="replay_dispatcher", daemon=True)
+        thread.start()
+
+        start = time.perf_counter()
+        first = updates[0][0] if updates else 0
+        for t, update in updates:
+            if speed:
+                delay = (t - first) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            self._enqueued[update.update_id] = time.perf_counter()
+            self.dispatcher.update_queue.put(update)
+
+        if updates:
+            self._done.wait(timeout)
+            self._wait_background(start + timeout)
+        seconds = time.perf_counter() - start
+        self.dispatcher.stop()
+        thread.join()
+
+        return ReplayReport(
+            updates=len(self._handler),
+            errors=self._errors + self._background_errors,
+            seconds=seconds,
+            handler=percentiles(self._handler),
+            end_to_end=percentiles(self._end_to_end),
+            calls=dict(self.request.calls),
+            background=percentiles(self._background),
+            background_errors=self._background_errors
+        )
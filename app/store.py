@@ -0,0 +1,185 @@
+import time
+from typing import Dict, Iterable, Iterator, List, Union
+
+import pymongo
+from pymongo import ASCENDING, IndexModel, UpdateOne
+
+from app.cluster import partition_of, DEFAULT_PARTITIONS, LEASES
+
+SUBSCRIPTIONS = "subscriptions"
+
+# Indexes required by the bot queries, by collection
+INDEXES: Dict[str, List[IndexModel]] = {
+    SUBSCRIPTIONS: [
+        IndexModel(
+            [("chat_id", ASCENDING), ("subreddit", ASCENDING)],
+            name="chat_id_subreddit",
+            unique=True
+        ),
+        IndexModel([("subreddit", ASCENDING)], name="subreddit"),
+        IndexModel([("partition", ASCENDING), ("paused", ASCENDING)], name="partition_paused"),
+    ],
+    LEASES: [
+        IndexModel([("owner", ASCENDING), ("expires_at", ASCENDING)], name="owner_expires_at"),
+    ],
+}
+
+# Fields of a subscription document
+SUBSCRIPTION_FIELDS = (
+    "chat_id", "subreddit", "limit", "interval", "paused", "digest", "partition", "created_at"
+)
+
+
+def get_database(cfg: Dict) -> pymongo.database.Database:
+    '''Connect to the database provided by config
+    :param: cfg: app configuration with MONGO_URI and MONGO_DB
+    '''
+    client = pymongo.MongoClient(cfg['MONGO_URI'])
+    return client[cfg['MONGO_DB']]
+
+
+def ensure_indexes(db: pymongo.database.Database) -> Dict[str, List[str]]:
+    '''Create all indexes required by the bot, returns
+    created index names by collection
+    :param: db: pymongo database
+    '''
+    return {
+        name: db[name].create_indexes(indexes)
+        for name, indexes in INDEXES.items()
+    }
+
+
+def missing_indexes(db: pymongo.database.Database) -> Dict[str, List[str]]:
+    '''Return required indexes which don't exist, by collection
+    :param: db: pymongo database
+    '''
+    missing = {}
+    for name, indexes in INDEXES.items():
+        existing = db[name].index_information()
+        absent = [x.document['name'] for x in indexes if x.document['name'] not in existing]
+        if absent:
+            missing[name] = absent
+    return missing
+
+
+def subscription_upsert(doc: Dict, partitions: int = DEFAULT_PARTITIONS) -> UpdateOne:
+    '''Make bulk_write upsert operation of the subscription.
+    Raises ValueError, KeyError or TypeError if the document isn't
+    a valid subscription.
+    :param: doc: subscription document
+    :param: partitions: total number of cluster partitions
+    '''
+    doc = {k: doc[k] for k in SUBSCRIPTION_FIELDS if k in doc}
+    # Same normalization as SubscriptionStore.save, the bot relies on it
+    doc["chat_id"] = int(doc["chat_id"])
+    if not isinstance(doc["subreddit"], str) or not doc["subreddit"]:
+        raise ValueError(f"subreddit must be a name, got {doc['subreddit']!r}")
+    doc["subreddit"] = doc["subreddit"].lower()
+    doc["limit"] = int(doc["limit"])
+    if doc["limit"] < 1:
+        raise ValueError(f"limit must be positive, got {doc['limit']}")
+    doc["interval"] = float(doc["interval"])
+    if not doc["interval"] > 0:
+        raise ValueError(f"interval must be positive, got {doc['interval']}")
+    doc["paused"] = bool(doc.get("paused", False))
+    doc["partition"] = partition_of(doc["chat_id"], partitions)
+    created_at = doc.pop("created_at", None) or time.time()
+    return UpdateOne(
+        {"chat_id": doc["chat_id"], "subreddit": doc["subreddit"]},
+        {"$set": doc, "$setOnInsert": {"created_at": created_at}},
+        upsert=True
+    )
+
+
+class SubscriptionStore(object):
+    """Persistent storage of subscriptions
+    :param: db: pymongo database
+    :param: partitions: total number of cluster partitions
+    """
+
+    def __init__(
+        self,
+        db: pymongo.database.Database,
+        partitions: int = DEFAULT_PARTITIONS
+    ) -> None:
+        self.db = db
+        self.collection = db[SUBSCRIPTIONS]
+        self.partitions = partitions
+
+    def save(
+        self,
+        chat_id: Union[int, str],
+        subreddit: str,
+        limit: int,
+        interval: float,
+        digest: bool = False
+    ) -> None:
+        '''Create or update the subscription
+        :param: chat_id: chat_id
+        :param: subreddit: subreddit name
+        :param: limit: number of posts to show
+        :param: interval: interval in seconds
+        :param: digest: the chat is in digest mode
+        '''
+        self.collection.bulk_write([subscription_upsert({
+            "chat_id": int(chat_id),
+            "subreddit": subreddit.lower(),
+            "limit": int(limit),
+            "interval": float(interval),
+            "digest": bool(digest),
+        }, self.partitions)])
+
+    def remove(self, chat_id: Union[int, str]) -> int:
+        '''Remove all subscriptions of the chat, returns number
+        of removed subscriptions
+        :param: chat_id: chat_id
+        '''
+        return self.collection.delete_many({"chat_id": int(chat_id)}).deleted_count
+
+    def set_paused(self, chat_id: Union[int, str], paused: bool) -> None:
+        '''Pause or resume all subscriptions of the chat
+        :param: chat_id: chat_id
+        :param: paused: new state
+        '''
+        self.collection.update_many({"chat_id": int(chat_id)}, {"$set": {"paused": paused}})
+
+    def migrate(self, chat_id: Union[int, str], new_chat_id: Union[int, str]) -> int:
+        '''Move all subscriptions of the chat to its new chat_id,
+        returns number of moved subscriptions
+        :param: chat_id: old chat_id
+        :param: new_chat_id: new chat_id
+        '''
+        docs = list(self.collection.find({"chat_id": int(chat_id)}, {"_id": False}))
+        if docs:
+            self.collection.bulk_write([
+                subscription_upsert(dict(x, chat_id=int(new_chat_id)), self.partitions) for x in docs
+            ])
+            self.collection.delete_many({"chat_id": int(chat_id)})
+        return len(docs)
+
+    def set_digest(self, chat_id: Union[int, str], digest: bool) -> None:
+        '''Turn digest mode of all subscriptions of the chat on or off
+        :param: chat_id: chat_id
+        :param: digest: new state
+        '''
+        self.collection.update_many({"chat_id": int(chat_id)}, {"$set": {"digest": digest}})
+
+    def digest_chats(self) -> List[int]:
+        '''Return chats in digest mode
+        '''
+        return self.collection.distinct("chat_id", {"digest": True})
+
+    def find_partitions(self, partitions: Iterable[int]) -> Iterator[Dict]:
+        '''Iterate over active subscriptions of the given partitions
+        :param: partitions: partition numbers
+        '''
+        return self.collection.find(
+            {"partition": {"$in": list(partitions)}, "paused": False},
+            {"_id": False}
+        )
+
+    def iter_all(self, batch_size: int = 1000) -> Iterator[Dict]:
+        '''Iterate over all subscriptions with a batched cursor
+        :param: batch_size: number of documents fetched per round trip
+        '''
+        return self.collection.find({}, {"_id": False}, batch_size=batch_size)
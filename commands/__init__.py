@@ -1,8 +1,9 @@
 import click
 
-from db import db
+from commands.db import db
+from commands.replay import replay
 
-cli = click.CommandCollection(sources=[db])
+cli = click.CommandCollection(sources=[db, replay])
 
 if __name__ == '__main__':
     cli()
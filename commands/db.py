@@ -1,26 +1,144 @@
+import sys
+import json
+import time
+
 import click
-import pymongo
 
-from app.helpers import load_yaml
+from app.helpers import load_yaml, batched
+from app.cluster import DEFAULT_PARTITIONS
+from app.store import (
+    ensure_indexes,
+    get_database,
+    missing_indexes,
+    subscription_upsert,
+    SubscriptionStore,
+    SUBSCRIPTIONS,
+    INDEXES
+)
 
 CFG_NAME = "app/config.yaml"
 
 
+def _get_cfg():
+    return load_yaml(CFG_NAME)
+
+
+def _get_db():
+    return get_database(_get_cfg())
+
+
 @click.group()
 def db():
-    '''
+    '''Database management commands
     '''
     pass
 
 
 @db.command()
 def init_db():
+    '''Create collections and indexes required by the bot
+    '''
+    database = _get_db()
+    for name, indexes in ensure_indexes(database).items():
+        click.echo(f"{name}: {', '.join(indexes)}")
+
+
+@db.command()
+def verify_indexes():
+    '''Check that all indexes required by the bot exist
+    '''
+    missing = missing_indexes(_get_db())
+    for name, indexes in missing.items():
+        click.echo(f"{name}: missing {', '.join(indexes)}", err=True)
+    if missing:
+        sys.exit(1)
+    click.echo("All indexes exist")
+
+
+@db.command()
+@click.option("--output", "-o", type=click.File("w"), default="-", help="JSON Lines file (stdout by default)")
+@click.option("--batch-size", default=1000, show_default=True, help="Documents fetched per round trip")
+def export_subs(output, batch_size):
+    '''Stream all subscriptions as JSON Lines
     '''
+    store = SubscriptionStore(_get_db())
+    count = 0
+    for doc in store.iter_all(batch_size):
+        output.write(json.dumps(doc) + "\n")
+        count += 1
+    click.echo(f"Exported {count} subscriptions", err=True)
+
+
+def _parse_subs(source, partitions, skipped):
+    '''Yield upserts of the JSON Lines subscriptions, reporting
+    and skipping malformed lines
+    '''
+    for number, line in enumerate(source, 1):
+        if not line.strip():
+            continue
+        try:
+            yield subscription_upsert(json.loads(line), partitions)
+        except (ValueError, KeyError, TypeError) as e:
+            click.echo(f"Line {number}: skipped, {e!r}", err=True)
+            skipped.append(number)
+
+
+@db.command()
+@click.argument("source", type=click.File("r"), default="-")
+@click.option("--batch-size", default=1000, show_default=True, help="Documents per bulk_write")
+def import_subs(source, batch_size):
+    '''Upsert subscriptions from JSON Lines file (stdin by default).
+    Malformed lines are reported and skipped, the exit code is 1 if any
+    '''
+    cfg = _get_cfg()
+    partitions = cfg.get('CLUSTER_PARTITIONS', DEFAULT_PARTITIONS)
+    collection = get_database(cfg)[SUBSCRIPTIONS]
+    start = time.monotonic()
+    upserted = modified = 0
+    skipped = []
+
+    for batch in batched(_parse_subs(source, partitions, skipped), batch_size):
+        result = collection.bulk_write(batch, ordered=False)
+        upserted += result.upserted_count
+        modified += result.modified_count
+
+    click.echo(
+        f"Imported {upserted} new, updated {modified} subscriptions "
+        f"in {time.monotonic() - start:.1f}s",
+        err=True
+    )
+    if skipped:
+        click.echo(f"Skipped {len(skipped)} malformed lines", err=True)
+        sys.exit(1)
+
+
+@db.command()
+def stats():
+    '''Show subscriptions statistics
     '''
-    cfg = load_yaml(CFG_NAME)
-    client = pymongo.MongoClient(cfg['MONGO_URI'])
-    db = client[cfg['MONGO_DB']]
+    database = _get_db()
+    collection = database[SUBSCRIPTIONS]
+    summary = next(collection.aggregate([{"$facet": {
+        "total": [{"$count": "n"}],
+        "paused": [{"$match": {"paused": True}}, {"$count": "n"}],
+        "chats": [{"$group": {"_id": "$chat_id"}}, {"$count": "n"}],
+        "subreddits": [{"$group": {"_id": "$subreddit"}}, {"$count": "n"}],
+        "top": [
+            {"$group": {"_id": "$subreddit", "n": {"$sum": 1}}},
+            {"$sort": {"n": -1}},
+            {"$limit": 10}
+        ],
+    }}], allowDiskUse=True))
+
+    def count(key):
+        return summary[key][0]["n"] if summary[key] else 0
+
+    click.echo(f"subscriptions: {count('total')} ({count('paused')} paused)")
+    click.echo(f"chats: {count('chats')}")
+    click.echo(f"subreddits: {count('subreddits')}")
+    for item in summary["top"]:
+        click.echo(f"  r/{item['_id']}: {item['n']}")
 
-    collist = db.list_collection_names()
-    if "jobs" not in collist:
-        db["jobs"]
+    for name in INDEXES:
+        size = database.command("collStats", name)
+        click.echo(f"{name}: {size['size']} bytes, indexes {size['totalIndexSize']} bytes")
@@ -0,0 +1,57 @@
+import click
+
+from app.bot import Bot
+from app.replay import load_updates, synthesize, Replayer
+
+
+@click.group()
+def replay():
+    '''Update-stream replay commands
+    '''
+    pass
+
+
+def _run(config, updates, speed, telegram_latency, reddit_latency):
+    bot = Bot(config_file=config)
+    bot.log.setLevel("WARNING")
+    replayer = Replayer(bot, telegram_latency=telegram_latency, reddit_latency=reddit_latency)
+    report = replayer.run(updates, speed=speed)
+    click.echo(report.format())
+
+
+_options = [
+    click.option("--config", default=Bot.default_config_filename, show_default=True,
+                 help="Bot config (relative to app/), its database and archive are not used"),
+    click.option("--speed", default=0.0, show_default=True,
+                 help="Replay speed multiplier, 0 - as fast as possible"),
+    click.option("--telegram-latency", default=0.0, show_default=True,
+                 help="Simulated Bot API latency in seconds"),
+    click.option("--reddit-latency", default=0.0, show_default=True,
+                 help="Simulated reddit latency in seconds"),
+]
+
+
+def replay_options(func):
+    for option in reversed(_options):
+        func = option(func)
+    return func
+
+
+@replay.command()
+@click.argument("log", type=click.Path(exists=True))
+@replay_options
+def replay_updates(log, config, speed, telegram_latency, reddit_latency):
+    '''Replay updates recorded with RECORD_PATH
+    '''
+    _run(config, load_updates(log), speed, telegram_latency, reddit_latency)
+
+
+@replay.command()
+@click.option("--users", default=50, show_default=True, help="Number of distinct users")
+@click.option("--updates", default=1000, show_default=True, help="Number of updates")
+@click.option("--seed", default=0, show_default=True, help="Random seed")
+@replay_options
+def replay_synthetic(users, updates, seed, config, speed, telegram_latency, reddit_latency):
+    '''Replay synthesized user sessions
+    '''
+    _run(config, synthesize(users, updates, seed), speed, telegram_latency, reddit_latency)
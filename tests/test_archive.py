@@ -0,0 +1,61 @@
+import time
+import logging
+from types import SimpleNamespace
+
+from app.archive import PostArchive
+from app.fetcher import ListingCache, RedditFetcher
+
+
+def make_post(n, age=0, score=None, **kwargs):
+    fields = dict(
+        id=f"p{n}", title=f"Post {n}", ups=score if score is not None else n,
+        num_comments=1, url=f"https://i.redd.it/{n}.jpg",
+        created_utc=time.time() - age, media=None,
+    )
+    fields.update(kwargs)
+    return SimpleNamespace(**fields)
+
+
+def test_archive_top_and_compact():
+    archive = PostArchive(":memory:")
+    posts = [make_post(1, score=10), make_post(2, score=30), make_post(3, age=3 * 86400, score=50)]
+    archive.store("aww", posts, "day")
+
+    assert [x.id for x in archive.top("aww", 2, "day", max_age=60)] == ["p2", "p1"]
+    assert archive.top("aww", 3, "day", max_age=60) is None
+    assert [x.id for x in archive.top("AWW", 3, "week")] == ["p3", "p2", "p1"]
+    assert archive.top("aww", 4, "week") is None
+    assert archive.top("pics", 1, "day", max_age=60) is None
+
+    assert archive.compact(86400) == 1
+    assert archive.top("aww", 3, "week") is None
+
+
+def test_archived_post_keeps_video():
+    archive = PostArchive(":memory:")
+    video = {"fallback_url": "video.mp4"}
+    archive.store("aww", [make_post(1, media={"reddit_video": video, "oembed": {}},
+                                    preview={"images": []})], "day")
+    post = archive.top("aww", 1, "day", max_age=60)[0]
+    assert post.media == {"reddit_video": video}
+    assert post.preview is None
+    assert post.subreddit.display_name == "aww"
+
+
+def test_fetcher_answers_from_archive():
+    requests = []
+
+    class Channel(object):
+        display_name = "aww"
+
+        def top(self, time_filter, limit):
+            requests.append(time_filter)
+            return [make_post(i, score=i) for i in range(limit)]
+
+    archive = PostArchive(":memory:")
+    fetcher = RedditFetcher(None, ListingCache(0), logging.getLogger("test"), archive)
+
+    assert len(fetcher.top(Channel(), 3)) == 3
+    assert len(fetcher.top(Channel(), 3)) == 3
+    assert len(fetcher.top(Channel(), 2, "week")) == 2
+    assert requests == ["day"]
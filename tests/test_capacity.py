@@ -0,0 +1,100 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.capacity import CapacityModel, ACCEPT, CLAMP, COARSEN, REJECT, REDDIT, TELEGRAM
+
+
+def test_usage():
+    model = CapacityModel(listing_ttl=300)
+    model.add(1, "aww", 2, 600)
+    model.add(2, "AWW", 1, 3600)
+    model.add(2, "pics", 1, 60)
+    usage = model.usage()
+    # aww at its fastest interval, pics not faster than the listing ttl
+    assert usage[REDDIT] == pytest.approx(6 + 12)
+    assert usage[TELEGRAM] == pytest.approx(12 + 1 + 60)
+
+    model.set_paused(2, True)
+    assert model.usage()[TELEGRAM] == pytest.approx(12)
+    model.remove(1)
+    assert model.usage() == {REDDIT: 0, TELEGRAM: 0}
+
+
+@pytest.mark.parametrize("limit, interval", [(0, 600), (1, 0), (-1, 600), (1, -36)])
+def test_admit_invalid(limit, interval):
+    assert CapacityModel().admit(1, "aww", limit, interval).action == REJECT
+
+
+def test_admit_clamp_and_coarsen():
+    model = CapacityModel(min_interval=300, max_limit=10, user_sends_per_hour=1000)
+    assert model.admit(1, "aww", 3, 3600) == (ACCEPT, 3, 3600, "")
+    assert model.admit(1, "aww", 50, 3600)[:3] == (CLAMP, 10, 3600)
+    # /sub aww 0.01 10
+    decision = model.admit(1, "aww", 10, 36)
+    assert decision.action == COARSEN
+    assert decision.interval == 300
+
+
+def test_admit_per_chat_caps():
+    model = CapacityModel(user_sends_per_hour=10, max_subscriptions=2)
+    model.add(1, "aww", 5, 3600)
+    # 5 sends/hour left for the chat
+    assert model.admit(1, "pics", 5, 600).interval == pytest.approx(3600)
+    # replacing a subscription doesn't count it twice
+    assert model.admit(1, "aww", 10, 3600).action == ACCEPT
+    model.add(1, "pics", 1, 3600)
+    assert model.admit(1, "cats", 1, 3600).action == REJECT
+    assert model.admit(2, "cats", 1, 3600).action == ACCEPT
+
+
+def test_admit_global_budget():
+    model = CapacityModel(reddit_calls_per_hour=2, telegram_sends_per_hour=100,
+                          user_sends_per_hour=100, max_interval=86400)
+    model.add(1, "aww", 1, 3600)
+    # the subreddit is already fetched hourly
+    assert model.admit(2, "aww", 1, 3600).action == ACCEPT
+    # one more reddit call per hour is left
+    assert model.admit(2, "pics", 1, 600).interval == pytest.approx(3600)
+    model.add(2, "pics", 1, 3600)
+    assert model.admit(3, "cats", 1, 3600).action == REJECT
+
+    model.add(3, "aww", 98, 3600)
+    assert model.utilization()[TELEGRAM] == pytest.approx(1)
+    assert model.admit(4, "aww", 1, 3600).action == REJECT
+
+
+def test_load():
+    model = CapacityModel()
+    model.add(9, "old", 1, 3600)
+    model.load([
+        {"chat_id": 1, "subreddit": "aww", "limit": 2, "interval": 3600.0, "paused": False},
+        {"chat_id": 2, "subreddit": "aww", "limit": 1, "interval": 3600.0, "paused": True},
+    ])
+    assert model.usage() == {REDDIT: 1, TELEGRAM: 2}
+
+
+def test_subscribe_admission(bot):
+    replies = []
+    jobs = []
+    update = SimpleNamespace(
+        message=SimpleNamespace(from_user=SimpleNamespace(id=4242), reply_text=replies.append)
+    )
+    context = SimpleNamespace(
+        args=["aww", "0.01", "10"],
+        job_queue=SimpleNamespace(
+            get_jobs_by_name=lambda name: [],
+            run_repeating=lambda callback, **kwargs: jobs.append(kwargs),
+        )
+    )
+    channel = SimpleNamespace(display_name="aww")
+
+    bot.subscribe_on_reddit_channel(update, context, channel)
+    assert jobs[0]["interval"] == bot.default_min_interval
+    assert "interval set to" in replies[-1]
+
+    context.args = ["aww", "-1", "1"]
+    bot.subscribe_on_reddit_channel(update, context, channel)
+    assert len(jobs) == 1
+    assert replies[-1].startswith("Subscription rejected")
+    bot.capacity.remove(4242)
@@ -0,0 +1,155 @@
+import os
+import time
+import multiprocessing
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from app.cluster import fair_share, partition_of, LeaseManager
+
+MONGO_URI = os.environ.get("TELEGAG_TEST_MONGO_URI")
+PARTITIONS = 16
+
+
+def test_partition_of():
+    assert partition_of(123, 16) == partition_of("123", 16)
+    assert {partition_of(x, 16) for x in range(1000)} == set(range(16))
+
+
+@pytest.mark.parametrize("instances,expected", [(0, 16), (1, 16), (3, 6), (16, 1), (20, 1)])
+def test_fair_share(instances, expected):
+    assert fair_share(16, instances) == expected
+
+
+def matches(doc, query):
+    for key, cond in query.items():
+        if key == "$or":
+            if not any(matches(doc, x) for x in cond):
+                return False
+        elif isinstance(cond, dict):
+            value = doc.get(key)
+            if "$gt" in cond and not (value is not None and value > cond["$gt"]):
+                return False
+            if "$lt" in cond and not (value is not None and value < cond["$lt"]):
+                return False
+        elif doc.get(key) != cond:
+            return False
+    return True
+
+
+class FakeCollection(object):
+    """In-memory subset of pymongo Collection used by LeaseManager"""
+
+    def __init__(self):
+        self.docs = {}
+
+    def _upsert(self, query, update):
+        if query["_id"] in self.docs:
+            raise DuplicateKeyError("duplicate _id")
+        doc = {"_id": query["_id"]}
+        doc.update(update["$set"])
+        self.docs[doc["_id"]] = doc
+
+    def update_one(self, query, update, upsert=False):
+        found = [x for x in self.docs.values() if matches(x, query)]
+        if found:
+            found[0].update(update["$set"])
+        elif upsert:
+            self._upsert(query, update)
+
+    def update_many(self, query, update):
+        for doc in self.docs.values():
+            if matches(doc, query):
+                doc.update(update["$set"])
+
+    def find_one_and_update(self, query, update, upsert=False):
+        self.update_one(query, update, upsert)
+
+    def find(self, query, projection=None):
+        return [dict(x) for x in self.docs.values() if matches(x, query)]
+
+    def count_documents(self, query):
+        return len(self.find(query))
+
+    def delete_one(self, query):
+        for doc in self.find(query):
+            del self.docs[doc["_id"]]
+            return
+
+
+def make_db():
+    return {"leases": FakeCollection(), "instances": FakeCollection()}
+
+
+@pytest.mark.parametrize("ttl,margin", [(30, 5), (3, 1), (0.3, 0.1)])
+def test_safety_margin(ttl, margin):
+    leases = LeaseManager(make_db(), PARTITIONS, ttl=ttl, instance_id="node")
+    assert leases.safety_margin == pytest.approx(margin)
+
+
+def test_invalid_ttl():
+    with pytest.raises(ValueError):
+        LeaseManager(make_db(), PARTITIONS, ttl=0)
+
+
+def test_leases_with_fake_db(monkeypatch):
+    db = make_db()
+    clock = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: clock[0])
+    monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+    nodes = [LeaseManager(db, PARTITIONS, ttl=3, instance_id=f"node{i}") for i in range(2)]
+
+    nodes[0].rebalance()
+    assert len(nodes[0].owned) == PARTITIONS
+    assert all(nodes[0].owns(x) for x in range(PARTITIONS))
+
+    # the second node joins, the first one gives half of the partitions away
+    nodes[1].rebalance()
+    nodes[0].rebalance()
+    nodes[1].rebalance()
+    assert len(nodes[0].owned) == len(nodes[1].owned) == PARTITIONS // 2
+    assert nodes[0].owned.isdisjoint(nodes[1].owned)
+    assert not nodes[1].claim(min(nodes[0].owned))
+
+    # leases are unsafe after ttl - safety margin without a heartbeat
+    partition = min(nodes[0].owned)
+    clock[0] += 3 - nodes[0].safety_margin
+    assert not nodes[0].owns(partition)
+
+    # the first node dies, its partitions are claimed once its leases expire
+    clock[0] += nodes[0].safety_margin + 0.1
+    nodes[1].rebalance()
+    assert len(nodes[1].owned) == PARTITIONS
+    assert all(nodes[1].owns(x) for x in range(PARTITIONS))
+
+
+def run_instance(name, rounds, results):
+    import pymongo
+    db = pymongo.MongoClient(MONGO_URI)["telegag_test_cluster"]
+    leases = LeaseManager(db, PARTITIONS, ttl=3, instance_id=name)
+    for _ in range(rounds):
+        leases.rebalance()
+        time.sleep(0.2)
+    results[name] = sorted(x for x in leases.owned if leases.owns(x))
+
+
+@pytest.mark.skipif(not MONGO_URI, reason="TELEGAG_TEST_MONGO_URI is not set")
+def test_instances_split_partitions():
+    import pymongo
+    pymongo.MongoClient(MONGO_URI).drop_database("telegag_test_cluster")
+
+    with multiprocessing.Manager() as manager:
+        results = manager.dict()
+        processes = [
+            multiprocessing.Process(target=run_instance, args=(f"node{i}", 25, results))
+            for i in range(3)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        owned = dict(results)
+
+    partitions = [x for held in owned.values() for x in held]
+    assert sorted(partitions) == list(range(PARTITIONS))
+    assert all(len(x) <= fair_share(PARTITIONS, 3) for x in owned.values())
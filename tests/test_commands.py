@@ -0,0 +1,166 @@
+import json
+import importlib
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+from click.testing import CliRunner
+
+from commands import cli
+from app.store import INDEXES, SUBSCRIPTIONS
+
+# commands.db attribute of the package is the click group
+db_module = importlib.import_module("commands.db")
+
+
+class FakeCollection(object):
+    """In-memory subset of pymongo Collection used by the db commands"""
+
+    def __init__(self):
+        self.docs = {}
+        self.indexes = set()
+        self.find_batch_sizes = []
+        self.writes = []
+
+    def create_indexes(self, indexes):
+        names = [x.document["name"] for x in indexes]
+        self.indexes.update(names)
+        return names
+
+    def index_information(self):
+        return {x: {} for x in self.indexes}
+
+    def find(self, query, projection=None, batch_size=0):
+        self.find_batch_sizes.append(batch_size)
+        return iter([dict(x) for x in self.docs.values()])
+
+    def bulk_write(self, ops, ordered=True):
+        self.writes.append((len(ops), ordered))
+        upserted = modified = 0
+        for op in ops:
+            key = (op._filter["chat_id"], op._filter["subreddit"])
+            if key in self.docs:
+                modified += 1
+            else:
+                upserted += 1
+                self.docs[key] = dict(op._doc["$setOnInsert"])
+            self.docs[key].update(op._doc["$set"])
+        return SimpleNamespace(upserted_count=upserted, modified_count=modified)
+
+    def aggregate(self, pipeline, allowDiskUse=False):
+        docs = list(self.docs.values())
+        subreddits = Counter(x["subreddit"] for x in docs)
+
+        def count(n):
+            return [{"n": n}] if n else []
+
+        yield {
+            "total": count(len(docs)),
+            "paused": count(sum(1 for x in docs if x.get("paused"))),
+            "chats": count(len({x["chat_id"] for x in docs})),
+            "subreddits": count(len(subreddits)),
+            "top": [{"_id": k, "n": v} for k, v in subreddits.most_common(10)],
+        }
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name):
+        collection = self[name] = FakeCollection()
+        return collection
+
+    def command(self, name, collection):
+        return {"size": 100, "totalIndexSize": 10}
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = FakeDatabase()
+    monkeypatch.setattr(db_module, "_get_cfg", lambda: {"CLUSTER_PARTITIONS": 16})
+    monkeypatch.setattr(db_module, "get_database", lambda cfg: database)
+    return database
+
+
+def make_subs(n):
+    return "".join(
+        json.dumps({"chat_id": i, "subreddit": f"sub{i % 7}", "limit": 1, "interval": 3600.0}) + "\n"
+        for i in range(n)
+    )
+
+
+def test_init_and_verify_indexes(database):
+    runner = CliRunner()
+    result = runner.invoke(cli, ["verify-indexes"])
+    assert result.exit_code == 1
+    assert "missing chat_id_subreddit" in result.output
+
+    result = runner.invoke(cli, ["init-db"])
+    assert result.exit_code == 0
+    assert all(database[x].indexes == {i.document["name"] for i in INDEXES[x]} for x in INDEXES)
+
+    result = runner.invoke(cli, ["verify-indexes"])
+    assert result.exit_code == 0
+
+
+def test_import_export_round_trip(database):
+    runner = CliRunner()
+    result = runner.invoke(cli, ["import-subs", "--batch-size", "40"], input=make_subs(100))
+    assert result.exit_code == 0, result.output
+    assert "Imported 100 new, updated 0" in result.output
+    assert database[SUBSCRIPTIONS].writes == [(40, False), (40, False), (20, False)]
+
+    result = runner.invoke(cli, ["import-subs"], input=make_subs(10))
+    assert "Imported 0 new, updated 10" in result.output
+
+    result = runner.invoke(cli, ["export-subs", "--batch-size", "25"])
+    assert result.exit_code == 0
+    assert database[SUBSCRIPTIONS].find_batch_sizes == [25]
+    exported = [json.loads(x) for x in result.output.splitlines() if x.startswith("{")]
+    assert len(exported) == 100
+    assert {x["partition"] for x in exported} <= set(range(16))
+
+    database[SUBSCRIPTIONS].docs.clear()
+    runner.invoke(cli, ["import-subs"], input="\n".join(json.dumps(x) for x in exported))
+    assert len(database[SUBSCRIPTIONS].docs) == 100
+
+
+def test_import_skips_malformed_lines(database):
+    lines = make_subs(3).splitlines()
+    lines[1:1] = ['{"chat_id": 1, broken', '{"subreddit": "aww"}', '[1, 2]']
+    result = CliRunner().invoke(cli, ["import-subs"], input="\n".join(lines))
+    assert result.exit_code == 1
+    assert "Line 2: skipped" in result.output
+    assert "Line 3: skipped" in result.output
+    assert "Line 4: skipped" in result.output
+    assert "Imported 3 new" in result.output
+    assert "Traceback" not in result.output
+
+
+def test_import_validates_and_normalizes(database):
+    lines = [
+        '{"chat_id": 1, "subreddit": "aww", "limit": "x", "interval": 60}',
+        '{"chat_id": 1, "subreddit": "aww", "limit": 1, "interval": -5}',
+        '{"chat_id": 1, "subreddit": "aww", "limit": 0, "interval": 60}',
+        '{"chat_id": 1, "subreddit": "Aww"}',
+        '{"chat_id": 1, "subreddit": 5, "limit": 1, "interval": 60}',
+        '{"chat_id": "2", "subreddit": "Aww", "limit": "3", "interval": 60}',
+        '{"chat_id": 2, "subreddit": "aww", "limit": 4, "interval": 60}',
+    ]
+    result = CliRunner().invoke(cli, ["import-subs"], input="\n".join(lines))
+    assert result.exit_code == 1
+    assert all(f"Line {x}: skipped" in result.output for x in range(1, 6))
+    assert "Line 6" not in result.output and "Line 7" not in result.output
+    assert database[SUBSCRIPTIONS].docs == {(2, "aww"): {
+        "chat_id": 2, "subreddit": "aww", "limit": 4, "interval": 60.0, "paused": False,
+        "partition": database[SUBSCRIPTIONS].docs[(2, "aww")]["partition"],
+        "created_at": database[SUBSCRIPTIONS].docs[(2, "aww")]["created_at"],
+    }}
+
+
+def test_stats(database):
+    runner = CliRunner()
+    runner.invoke(cli, ["import-subs"], input=make_subs(14))
+    result = runner.invoke(cli, ["stats"])
+    assert result.exit_code == 0, result.output
+    assert "subscriptions: 14 (0 paused)" in result.output
+    assert "subreddits: 7" in result.output
+    assert "  r/sub0: 2" in result.output
@@ -0,0 +1,130 @@
+from types import SimpleNamespace
+
+from telegram.error import BadRequest, ChatMigrated, RetryAfter, TimedOut, Unauthorized
+
+from app.delivery import (
+    classify_error,
+    RetryItem,
+    RetryQueue,
+    CHAT_MIGRATED,
+    DROPPED,
+    RETRYABLE,
+    PERMANENT_CHAT,
+    PERMANENT_MEDIA
+)
+from app.payload import Payload
+
+PAYLOAD = Payload("photo", "https://i.redd.it/cat.jpg", "caption")
+
+
+def test_classify_error():
+    assert classify_error(Unauthorized("Forbidden: bot was blocked by the user")) == PERMANENT_CHAT
+    assert classify_error(BadRequest("Chat not found")) == PERMANENT_CHAT
+    assert classify_error(BadRequest("Wrong file identifier/http url specified")) == PERMANENT_MEDIA
+    assert classify_error(BadRequest("Can't parse entities: can't find end of the entity")) == DROPPED
+    assert classify_error(ChatMigrated(-1001)) == CHAT_MIGRATED
+    assert classify_error(TimedOut()) == RETRYABLE
+    assert classify_error(RetryAfter(3)) == RETRYABLE
+
+
+def test_retry_queue_backoff_and_bounds():
+    queue = RetryQueue(max_size=2, max_attempts=3, backoff=0)
+    assert queue.delay(RetryItem(1, PAYLOAD, 3)) == 0
+    assert RetryQueue(backoff=5).delay(RetryItem(1, PAYLOAD, 3)) == 20
+    assert queue.delay(RetryItem(1, PAYLOAD, 1), RetryAfter(7)) == 7
+
+    assert queue.push(RetryItem(1, PAYLOAD, 1))
+    assert queue.push(RetryItem(2, PAYLOAD, 2))
+    assert not queue.push(RetryItem(3, PAYLOAD, 1))
+    assert [x.chat_id for x in queue.pop_due()] == [1, 2]
+    assert not queue.push(RetryItem(4, PAYLOAD, 3))
+    assert len(queue) == 0
+
+
+def make_context(error, jobs):
+    def send_photo(**kwargs):
+        raise error
+
+    return SimpleNamespace(
+        bot=SimpleNamespace(send_photo=send_photo),
+        job_queue=SimpleNamespace(get_jobs_by_name=lambda name: jobs)
+    )
+
+
+def test_deliver_pauses_blocked_chat(bot):
+    job = SimpleNamespace(enabled=True)
+    context = make_context(Unauthorized("Forbidden: bot was blocked by the user"), [job])
+
+    assert not bot._deliver(context, RetryItem(42, PAYLOAD))
+    assert not job.enabled
+    assert "42" in bot.paused_chats
+
+    bot.resume_chat(context, 42)
+    assert job.enabled
+    assert "42" not in bot.paused_chats
+
+
+def test_deliver_remembers_bad_media(bot):
+    context = make_context(BadRequest("Failed to get http url content"), [])
+    payload = PAYLOAD._replace(media="https://i.redd.it/broken.jpg")
+
+    assert bot._deliver(context, RetryItem(1, payload))
+    assert payload.media in bot.bad_media
+    assert bot._deliver(SimpleNamespace(bot=None), RetryItem(1, payload))
+
+
+def test_deliver_queues_retryable(bot):
+    context = make_context(TimedOut(), [])
+    size = len(bot.retries)
+    assert bot._deliver(context, RetryItem(1, PAYLOAD))
+    assert len(bot.retries) == size + 1
+
+
+def test_deliver_drops_unknown_bad_request(bot):
+    context = make_context(BadRequest("Message caption is too long"), [])
+    payload = PAYLOAD._replace(media="https://i.redd.it/long.jpg")
+    size = len(bot.retries)
+
+    assert bot._deliver(context, RetryItem(1, payload))
+    assert payload.media not in bot.bad_media
+    assert len(bot.retries) == size
+
+
+def test_deliver_retargets_migrated_chat(bot):
+    sent = []
+    scheduled = []
+    job = SimpleNamespace(
+        callback=bot.send_reddit_post,
+        context={'chat_id': 7, 'channel': None, 'limit': 1, 'interval': 600.0},
+        removed=False
+    )
+    job.schedule_removal = lambda: setattr(job, "removed", True)
+
+    def send_photo(chat_id, **kwargs):
+        if chat_id == 7:
+            raise ChatMigrated(-1007)
+        sent.append(chat_id)
+
+    def run_repeating(callback, **kwargs):
+        scheduled.append(kwargs)
+
+    context = SimpleNamespace(
+        bot=SimpleNamespace(send_photo=send_photo),
+        job_queue=SimpleNamespace(
+            get_jobs_by_name=lambda name: [job] if name == "7" else [],
+            run_repeating=run_repeating
+        )
+    )
+    bot.capacity.add(7, "aww", 1, 600)
+    bot.digest_chats.add("7")
+
+    assert bot._deliver(context, RetryItem(7, PAYLOAD))
+    assert sent == [-1007]
+    assert job.removed
+    assert scheduled[0]['name'] == "-1007"
+    assert scheduled[0]['context']['chat_id'] == -1007
+    assert "-1007" in bot.digest_chats and "7" not in bot.digest_chats
+    assert ("-1007", "aww") in bot.capacity._subscriptions
+    assert ("7", "aww") not in bot.capacity._subscriptions
+    bot.capacity.remove(-1007)
+    bot.digest_chats.discard("-1007")
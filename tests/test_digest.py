@@ -0,0 +1,162 @@
+from types import SimpleNamespace
+
+from app.digest import DigestBuffer, DigestEntry
+from app.payload import Payload
+
+
+def make_entry(media, kind="photo"):
+    return DigestEntry(Payload(kind, media, "caption"), "aww", "Cat", "https://redd.it/x", 10, 2)
+
+
+def test_digest_buffer():
+    buffer = DigestBuffer()
+    assert buffer.add(1, make_entry("a.jpg"))
+    assert not buffer.add(1, make_entry("b.jpg"))
+    assert not buffer.add(1, make_entry("a.jpg"))
+    assert [x.payload.media for x in buffer.pop(1)] == ["a.jpg", "b.jpg"]
+    assert buffer.pop(1) == []
+
+
+def make_post(n, sub):
+    return SimpleNamespace(
+        id=f"{sub}{n}", title=f"Post {n}.", ups=100 + n, num_comments=n,
+        url=f"https://i.redd.it/{sub}{n}.jpg", media=None, preview=None,
+        subreddit=SimpleNamespace(display_name=sub)
+    )
+
+
+class FakeJobQueue(object):
+    def __init__(self):
+        self.scheduled = []
+
+    def run_once(self, callback, when, context, name):
+        self.scheduled.append(SimpleNamespace(callback=callback, context=context, name=name))
+
+
+def test_digest_merges_subscriptions(bot, monkeypatch):
+    chat_id = 777
+    calls = []
+    job_queue = FakeJobQueue()
+    context = SimpleNamespace(
+        job_queue=job_queue,
+        bot=SimpleNamespace(
+            send_media_group=lambda **kwargs: calls.append(("album", kwargs)),
+            send_message=lambda **kwargs: calls.append(("index", kwargs)),
+        )
+    )
+    listings = {"aww": [make_post(i, "aww") for i in range(3)],
+                "pics": [make_post(i, "pics") for i in range(2)]}
+    monkeypatch.setattr(bot.fetcher, "top", lambda channel, limit, time_filter=None: listings[channel.display_name])
+    bot.digest_chats.add(str(chat_id))
+
+    for name in listings:
+        context.job = SimpleNamespace(context={
+            'chat_id': chat_id, 'channel': SimpleNamespace(display_name=name), 'limit': 3
+        })
+        bot.send_reddit_post(context)
+
+    assert len(job_queue.scheduled) == 1
+    context.job = job_queue.scheduled[0]
+    bot.send_digest(context)
+
+    assert [x[0] for x in calls] == ["album", "index"]
+    assert len(calls[0][1]["media"]) == 5
+    text = calls[1][1]["text"]
+    assert text.count("\n") == 4
+    assert "[Post 0\\.](https://redd.it/aww0) r/aww \\- *100* likes, *0* comments" in text
+    bot.digest_chats.discard(str(chat_id))
+
+
+def test_digest_long_index_and_animations(bot):
+    chat_id = 778
+    calls = []
+
+    def send_message(**kwargs):
+        calls.append(("index", kwargs))
+
+    context = SimpleNamespace(
+        job=SimpleNamespace(context={'chat_id': chat_id}),
+        bot=SimpleNamespace(
+            send_media_group=lambda **kwargs: calls.append(("album", kwargs)),
+            send_animation=lambda **kwargs: calls.append(("animation", kwargs)),
+            send_message=send_message,
+        )
+    )
+    for i in range(80):
+        bot.digests.add(chat_id, DigestEntry(
+            Payload("photo", f"https://i.redd.it/{i}.jpg", "caption"),
+            "aww", "T" * 300, f"https://redd.it/x{i}", 10, 2
+        ))
+    bot.digests.add(chat_id, make_entry("https://v.redd.it/gif.mp4", kind="animation"))
+    bot.send_digest(context)
+
+    kinds = [x[0] for x in calls]
+    assert kinds.count("album") == 8
+    assert kinds.count("animation") == 1
+    index = [x[1]["text"] for x in calls if x[0] == "index"]
+    assert len(index) > 1
+    assert all(len(x) <= 4096 for x in index)
+    assert sum(x.count("\n") + 1 for x in index) == 81
+
+
+def test_digest_index_failure_falls_back(bot):
+    from telegram.error import BadRequest
+    chat_id = 779
+    sent = []
+
+    def send_message(**kwargs):
+        raise BadRequest("Can't parse entities")
+
+    context = SimpleNamespace(
+        job=SimpleNamespace(context={'chat_id': chat_id}),
+        bot=SimpleNamespace(
+            send_photo=lambda **kwargs: sent.append(kwargs["photo"]),
+            send_message=send_message,
+        )
+    )
+    bot.digests.add(chat_id, make_entry("https://i.redd.it/bad.jpg"))
+    bot.bad_media.set("https://i.redd.it/bad.jpg", True)
+    bot.digests.add(chat_id, make_entry("https://i.redd.it/ok.jpg"))
+    bot.send_digest(context)
+    bot.bad_media.pop("https://i.redd.it/bad.jpg")
+    # the album of one photo is sent with _deliver, the bad one is skipped
+    assert sent == ["https://i.redd.it/ok.jpg"]
+
+
+class FakeStore(object):
+    def __init__(self, docs):
+        self.docs = docs
+
+    def set_digest(self, chat_id, digest):
+        for doc in self.docs:
+            if doc["chat_id"] == int(chat_id):
+                doc["digest"] = digest
+
+    def find_partitions(self, partitions):
+        return [dict(x) for x in self.docs if x["partition"] in partitions]
+
+    def digest_chats(self):
+        return [x["chat_id"] for x in self.docs if x.get("digest")]
+
+
+def test_digest_mode_is_stored(bot, monkeypatch):
+    docs = [{"chat_id": 780, "subreddit": "aww", "limit": 1, "interval": 3600.0, "partition": 0}]
+    monkeypatch.setattr(bot, "store", FakeStore(docs))
+    replies = []
+    update = SimpleNamespace(
+        effective_chat=SimpleNamespace(id=780),
+        message=SimpleNamespace(reply_text=replies.append)
+    )
+    bot.set_digest(update, SimpleNamespace(args=["on"]))
+    assert docs[0]["digest"] is True
+
+    # another instance loads the partition
+    bot.digest_chats.discard("780")
+    job_queue = SimpleNamespace(run_repeating=lambda *args, **kwargs: SimpleNamespace(context=kwargs["context"], schedule_removal=lambda: None))
+    bot._load_partitions(job_queue, {0})
+    assert "780" in bot.digest_chats
+
+    bot.set_digest(update, SimpleNamespace(args=["off"]))
+    bot._load_partitions(job_queue, {0})
+    assert "780" not in bot.digest_chats
+    bot._drop_partition(0)
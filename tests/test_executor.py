@@ -0,0 +1,135 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from app.executor import BlockingExecutor, ExecutorTimeoutError
+
+
+def test_executor_limits():
+    release = threading.Event()
+    executor = BlockingExecutor(max_workers=1, max_pending=3, per_user=2)
+
+    assert executor.submit(1, release.wait)
+    assert executor.submit(1, release.wait)
+    assert not executor.submit(1, release.wait)
+    assert executor.submit(2, release.wait)
+    assert not executor.submit(3, release.wait)
+
+    release.set()
+    executor.shutdown()
+
+
+def test_executor_callbacks_and_timeout():
+    release = threading.Event()
+    results, errors = [], []
+    executor = BlockingExecutor(max_workers=1, timeout=0.05)
+
+    executor.submit(1, release.wait, 1)
+    executor.submit(2, lambda: 42, on_done=results.append, on_error=errors.append)
+    time.sleep(0.1)
+    release.set()
+    executor.submit(3, lambda: 42, on_done=results.append, on_error=errors.append)
+    executor.submit(4, lambda: 1 / 0, on_error=errors.append)
+    executor.shutdown()
+
+    assert results == [42]
+    assert [type(x) for x in errors] == [ExecutorTimeoutError, ZeroDivisionError]
+
+
+def test_executor_on_done_errors(caplog):
+    errors = []
+    executor = BlockingExecutor(max_workers=1)
+
+    def fail(result):
+        raise RuntimeError(result)
+
+    executor.submit(1, lambda: "send failed", on_done=fail, on_error=errors.append)
+    executor.submit(2, lambda: "nobody handles it", on_done=fail)
+    executor.shutdown()
+
+    assert [str(x) for x in errors] == ["send failed"]
+    assert "nobody handles it" in caplog.text
+
+
+def test_subreddit_helper_not_found(bot, monkeypatch):
+    def search(name):
+        if name == "nosuchchannel":
+            return []
+        return [SimpleNamespace(display_name=name)]
+
+    monkeypatch.setattr(bot.reddit, "subreddits", SimpleNamespace(search_by_name=search))
+    replies = []
+    context = SimpleNamespace(user_data={})
+
+    def send(text):
+        update = SimpleNamespace(
+            message=SimpleNamespace(text=text, reply_text=replies.append, from_user=None),
+            callback_query=None,
+            effective_user=SimpleNamespace(id=7),
+        )
+        return update
+
+    def wait_replies(count):
+        deadline = time.monotonic() + 5
+        while len(replies) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    assert bot.subreddit_helper(send("nosuchchannel"), context) == bot.LIMIT
+    wait_replies(1)
+    assert replies == [bot.channel_not_found_text]
+
+    # the next message is taken as a channel name again
+    assert bot.limit_helper(send("aww"), context) == bot.LIMIT
+    wait_replies(2)
+    assert replies[-1] == bot.questions["limit"]
+    assert context.user_data['channel'].display_name == "aww"
+
+    assert bot.limit_helper(send("3"), context) == bot.TIMERANGE
+    assert context.user_data['limit'] == "3"
+
+
+def make_update(user_id, edits):
+    query = SimpleNamespace(
+        answer=lambda: None,
+        edit_message_text=lambda **kwargs: edits.append(kwargs)
+    )
+    return SimpleNamespace(
+        message=None,
+        callback_query=query,
+        effective_user=SimpleNamespace(id=user_id),
+        effective_chat=None
+    )
+
+
+def test_callback_latency_under_slow_reddit(bot, monkeypatch):
+    '''Dispatcher workers stay responsive while reddit is slow:
+    p99 latency of top channels and menu callbacks is measured
+    on a pool of 4 workers (default PTB dispatcher size).
+    '''
+    def slow_popular():
+        time.sleep(0.2)
+        return [SimpleNamespace(display_name="aww")]
+
+    monkeypatch.setattr(bot, "get_popular_subreddits", slow_popular)
+    edits = []
+    latencies = []
+
+    def press(user_id):
+        update = make_update(user_id, edits)
+        handler = bot.top_channels_helper if user_id % 2 else bot.show_help
+        start = time.perf_counter()
+        handler(update, None)
+        latencies.append(time.perf_counter() - start)
+
+    with ThreadPoolExecutor(4) as dispatcher:
+        list(dispatcher.map(press, range(100)))
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    assert p99 < 0.1, f"p99 callback latency {p99:.3f}s"
+
+    deadline = time.monotonic() + 10
+    while len(edits) < 100 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert len(edits) == 100
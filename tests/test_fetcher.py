@@ -0,0 +1,86 @@
+import logging
+from types import SimpleNamespace
+
+from app.fetcher import ListingCache, RedditFetcher
+
+
+def make_post(sub, n):
+    return SimpleNamespace(id=f"{sub}{n}", subreddit=SimpleNamespace(display_name=sub))
+
+
+class FakeSubreddit(object):
+    def __init__(self, reddit, name):
+        self.reddit = reddit
+        self.display_name = name
+
+    def top(self, time_filter, limit):
+        self.reddit.requests.append(self.display_name)
+        posts = []
+        for name in self.display_name.split("+"):
+            posts.extend(self.reddit.listings.get(name, []))
+        return iter(posts[:limit])
+
+
+class FakeReddit(object):
+    def __init__(self, listings):
+        self.listings = listings
+        self.requests = []
+
+    def subreddit(self, name):
+        return FakeSubreddit(self, name)
+
+
+def make_fetcher(listings):
+    reddit = FakeReddit(listings)
+    return reddit, RedditFetcher(reddit, ListingCache(60), logging.getLogger("test"))
+
+
+def test_pack_respects_limits():
+    _, fetcher = make_fetcher({})
+    fetcher.max_batch_size = 2
+    batches = fetcher.pack({"a": 1, "b": 1, "c": 1})
+    assert batches == [["a", "b"], ["c"]]
+
+    fetcher.max_batch_size = 50
+    batches = fetcher.pack({"a": 60, "b": 60})
+    assert batches == [["a"], ["b"]]
+
+    fetcher.max_path_length = 3
+    assert fetcher.pack({"aa": 1, "bb": 1}) == [["aa"], ["bb"]]
+
+
+def test_fetch_many_uses_combined_listing():
+    listings = {x: [make_post(x, i) for i in range(3)] for x in ("aww", "pics", "funny")}
+    reddit, fetcher = make_fetcher(listings)
+
+    fetcher.fetch_many({"aww": 2, "pics": 2, "funny": 3})
+
+    assert reddit.requests == ["aww+funny+pics"]
+    assert [x.id for x in fetcher.top(FakeSubreddit(reddit, "aww"), 2)] == ["aww0", "aww1"]
+    assert len(fetcher.top(FakeSubreddit(reddit, "funny"), 3)) == 3
+    assert reddit.requests == ["aww+funny+pics"]
+
+
+def test_fetch_many_falls_back_for_short_listings():
+    listings = {
+        "aww": [make_post("aww", i) for i in range(150)],
+        "pics": [make_post("pics", i) for i in range(5)],
+    }
+    reddit, fetcher = make_fetcher(listings)
+
+    fetcher.fetch_many({"aww": 3, "pics": 3})
+
+    assert reddit.requests == ["aww+pics", "pics"]
+    assert len(fetcher.top(FakeSubreddit(reddit, "pics"), 3)) == 3
+
+
+def test_listing_cache_is_bounded():
+    cache = ListingCache(60, max_size=2)
+    for name in ("a", "b", "c"):
+        cache.put(name, [1], exhausted=True)
+    assert cache.get("a", 1) is None
+    assert cache.get("c", 1) == [1]
+
+    cache = ListingCache(-1)
+    cache.put("a", [1])
+    assert cache.evict_expired() == 1
@@ -0,0 +1,171 @@
+from types import SimpleNamespace
+
+import pytest
+from prawcore.exceptions import NotFound
+from telegram import (
+    Chat,
+    InlineQueryResultCachedPhoto,
+    InlineQueryResultMpeg4Gif,
+    InlineQueryResultPhoto,
+    Message,
+    PhotoSize,
+)
+
+from app.inline import RecentListings, inline_result, is_image_url, parse_offset, parse_query, sent_file_id
+from app.payload import Payload
+
+
+def make_post(n, sub="aww", thumbnail="default"):
+    return SimpleNamespace(
+        id=f"{sub}{n}", title=f"Post {n}", ups=100 + n, num_comments=n,
+        url=f"https://i.redd.it/{sub}{n}.jpg", media=None, preview=None,
+        thumbnail=thumbnail, subreddit=SimpleNamespace(display_name=sub)
+    )
+
+
+@pytest.mark.parametrize("query, name", [
+    ("aww", "aww"), (" r/Aww cats", "Aww"), ("", None), ("a", None), ("a-b", None),
+])
+def test_parse_query(query, name):
+    assert parse_query(query) == name
+
+
+def test_parse_offset():
+    assert parse_offset("") == 0
+    assert parse_offset("40") == 40
+    assert parse_offset("x") == 0
+
+
+def test_recent_listings():
+    recent = RecentListings(60)
+    assert recent.get("aww") is None
+    assert recent.start_loading("aww")
+    assert not recent.start_loading("AWW")
+
+    recent.put("aww", [make_post(i) for i in range(5)])
+    assert recent.start_loading("aww")
+    # a short listing refreshes the top of the known one
+    recent.put("Aww", [make_post(9), make_post(0)])
+    posts, age = recent.get("aww")
+    assert [x.id for x in posts] == ["aww9", "aww0", "aww1", "aww2", "aww3", "aww4"]
+    assert age < 1
+
+    recent.put("aww", [make_post(7)], exhausted=True)
+    assert [x.id for x in recent.get("aww")[0]] == ["aww7"]
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("https://i.redd.it/abc", True),
+    ("https://i.imgur.com/abc.JPG", True),
+    ("https://example.com/a.png?width=640", True),
+    ("https://www.reddit.com/gallery/abc", False),
+    ("https://www.reddit.com/r/aww/comments/abc/title/", False),
+    ("https://example.com/article", False),
+    ("ftp://example.com/a.jpg", False),
+])
+def test_is_image_url(url, expected):
+    assert is_image_url(url) == expected
+
+
+def test_inline_result():
+    post = make_post(1)
+    photo = Payload("photo", post.url, "caption")
+    assert isinstance(inline_result(post, photo), InlineQueryResultPhoto)
+    assert isinstance(inline_result(post, photo, "file-id"), InlineQueryResultCachedPhoto)
+    link = Payload("photo", "https://www.reddit.com/gallery/abc", "caption")
+    assert inline_result(post, link) is None
+
+    gif = Payload("animation", "https://v.redd.it/x/DASH_360.mp4", "caption")
+    assert isinstance(inline_result(post, gif), InlineQueryResultMpeg4Gif)
+
+    video = Payload("video", "https://v.redd.it/x/DASH_720.mp4", "caption")
+    assert inline_result(post, video) is None
+    assert inline_result(make_post(1, thumbnail="https://b.thumbs.redditmedia.com/x.jpg"), video)
+
+
+def test_sent_file_id():
+    message = Message(1, None, Chat(1, "private"), photo=[
+        PhotoSize("small", "s", 90, 90), PhotoSize("big", "b", 800, 800)
+    ])
+    assert sent_file_id(message, "photo") == "big"
+    assert sent_file_id(message, "video") is None
+    assert sent_file_id(None, "photo") is None
+
+
+class FakeInlineQuery(object):
+    def __init__(self, query, offset=""):
+        self.id = "1"
+        self.query = query
+        self.offset = offset
+        self.from_user = SimpleNamespace(id=5)
+        self.answers = []
+
+    def answer(self, results, **kwargs):
+        self.answers.append((results, kwargs))
+
+
+def test_answer_inline_query(bot, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(bot.reddit_executor, "submit",
+                        lambda user_id, func, on_done=None, on_error=None: submitted.append(on_done) or True)
+
+    query = FakeInlineQuery("inlinetest")
+    bot.answer_inline_query(SimpleNamespace(inline_query=query), None)
+    results, kwargs = query.answers[-1]
+    assert results == []
+    assert kwargs["switch_pm_text"].startswith("Loading r/inlinetest")
+    assert len(submitted) == 1
+
+    # the listing is being fetched already
+    bot.answer_inline_query(SimpleNamespace(inline_query=query), None)
+    assert len(submitted) == 1
+
+    posts = [make_post(i, "inlinetest") for i in range(30)]
+    submitted[0](posts)
+    bot.file_ids.set(posts[0].url, "file-id")
+    bot.answer_inline_query(SimpleNamespace(inline_query=query), None)
+    results, kwargs = query.answers[-1]
+    assert len(results) == bot.inline_page_size
+    assert isinstance(results[0], InlineQueryResultCachedPhoto)
+    assert kwargs["next_offset"] == str(bot.inline_page_size)
+    assert kwargs["cache_time"] == bot.default_inline_cache_time
+
+    query = FakeInlineQuery("inlinetest", offset=kwargs["next_offset"])
+    bot.answer_inline_query(SimpleNamespace(inline_query=query), None)
+    results, kwargs = query.answers[-1]
+    assert [x.id for x in results] == [x.id for x in posts[bot.inline_page_size:]]
+    assert kwargs["next_offset"] == ""
+    assert len(submitted) == 1
+
+
+def test_inline_skips_posts_that_cant_be_rendered(bot):
+    photo = make_post(0, "inlinelinks")
+    youtube = make_post(1, "inlinelinks")
+    youtube.url = "https://www.youtube.com/watch?v=abc"
+    youtube.media = {"type": "youtube.com", "oembed": {"type": "video"}}
+    broken = make_post(2, "inlinelinks")
+    broken.media = {"reddit_video": {"height": 720}}
+    bot.recent.put("inlinelinks", [photo, youtube, broken], exhausted=True)
+
+    query = FakeInlineQuery("inlinelinks")
+    bot.answer_inline_query(SimpleNamespace(inline_query=query), None)
+    results, _ = query.answers[-1]
+    assert [x.id for x in results] == [photo.id]
+
+
+def test_inline_loading_mark_is_cleared(bot, monkeypatch):
+    errors = []
+    monkeypatch.setattr(bot.reddit_executor, "submit", lambda *args, **kwargs: False)
+    bot._load_inline_listing(5, "inlinebusy")
+    assert bot.recent.start_loading("inlinebusy")
+
+    monkeypatch.setattr(bot.reddit_executor, "submit",
+                        lambda user_id, func, on_done=None, on_error=None: errors.append(on_error) or True)
+    bot._load_inline_listing(5, "inlinemissing")
+    errors[-1](NotFound(SimpleNamespace(status_code=404)))
+    assert bot.recent.get("inlinemissing")[0] == []
+
+    bot._load_inline_listing(5, "inlinedown")
+    errors[-1](TimeoutError())
+    assert bot.recent.get("inlinedown") is None
+    assert bot.recent.start_loading("inlinedown")
@@ -0,0 +1,43 @@
+from urllib.request import urlopen
+
+from app.metrics import Counter, Gauge, Histogram, Registry, start_metrics_server
+
+
+def make_registry():
+    registry = Registry()
+    counter = registry.register(Counter("requests_total", "Requests", ["method"]))
+    gauge = registry.register(Gauge("depth", "Queue depth", ["queue"]))
+    histogram = registry.register(Histogram("latency_seconds", "Latency", buckets=(0.1, 1)))
+    return registry, counter, gauge, histogram
+
+
+def test_expose():
+    registry, counter, gauge, histogram = make_registry()
+    counter.inc(method="send_photo")
+    counter.inc(2, method="send_photo")
+    gauge.set_function(lambda: 5, queue="retry")
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(3)
+
+    text = registry.expose()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{method="send_photo"} 3.0' in text
+    assert 'depth{queue="retry"} 5.0' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1.0' in text
+    assert 'latency_seconds_bucket{le="1.0"} 2.0' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 3.0' in text
+    assert "latency_seconds_sum 3.55" in text
+    assert "latency_seconds_count 3.0" in text
+
+
+def test_metrics_server():
+    registry, counter, _, _ = make_registry()
+    counter.inc(method="send_video")
+    server = start_metrics_server(0, registry=registry)
+    try:
+        with urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+            body = response.read().decode()
+        assert 'requests_total{method="send_video"} 1.0' in body
+    finally:
+        server.shutdown()
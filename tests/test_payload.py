@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+from app.payload import Payload, PayloadCache
+
+
+def make_post(ups=1234, **kwargs):
+    fields = dict(id="abc", title="Cute cat.", ups=ups, num_comments=5,
+                  url="https://i.redd.it/cat.jpg", media=None, preview=None)
+    fields.update(kwargs)
+    return SimpleNamespace(**fields)
+
+
+def test_payload_version():
+    assert PayloadCache.version(make_post(ups=1234)) == 1200
+    assert PayloadCache.version(make_post(ups=7)) == 7
+
+
+def test_payload_rendered_once():
+    renders = []
+
+    def render(post):
+        renders.append(post.id)
+        return Payload("photo", post.url, str(post.ups))
+
+    cache = PayloadCache(60)
+    for _ in range(3):
+        cache.get(make_post(ups=1234), render)
+    cache.get(make_post(ups=1240), render)
+    assert renders == ["abc"]
+
+    cache.get(make_post(ups=1500), render)
+    assert renders == ["abc", "abc"]
+
+
+def test_render_payload(bot):
+    post = make_post(preview={"reddit_video_preview": {"fallback_url": "gif.mp4"}})
+    payload = bot._render_payload(post)
+    assert payload.kind == "animation"
+    assert payload.media == "gif.mp4"
+    assert "*1234* likes, *5* comments" in payload.caption
+
+    post = make_post(media={"reddit_video": {"fallback_url": "video.mp4"}}, ups=-1)
+    payload = bot._render_payload(post)
+    assert payload == Payload("video", "video.mp4", payload.caption)
+    assert "\\-1" in payload.caption
+
+    assert bot._render_payload(make_post()).kind == "photo"
+
+    post = make_post(
+        url="https://www.youtube.com/watch?v=abc",
+        media={"type": "youtube.com", "oembed": {"type": "video"}}
+    )
+    payload = bot._render_payload(post)
+    assert (payload.kind, payload.media) == ("photo", post.url)
+
+    post = make_post(media={"oembed": {}}, preview={"reddit_video_preview": {"fallback_url": "preview.mp4"}})
+    assert bot._render_payload(post).media == "preview.mp4"
+
+
+def test_send_reddit_post_uses_payload(bot):
+    calls = []
+    context = SimpleNamespace(bot=SimpleNamespace(
+        send_photo=lambda **kwargs: calls.append(kwargs)
+    ))
+    bot._send_reddit_post(context, make_post(id="xyz"), 1)
+    bot._send_reddit_post(context, make_post(id="xyz"), 2)
+    assert [x["chat_id"] for x in calls] == [1, 2]
+    assert calls[0]["photo"] == "https://i.redd.it/cat.jpg"
+    assert calls[0]["caption"] is calls[1]["caption"]
@@ -0,0 +1,79 @@
+import sys
+import time
+import threading
+from types import SimpleNamespace
+
+from app.profiler import MemoryProfiler, ProfilingSession, SamplingProfiler, is_idle
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def idle_wait(stop):
+    stop.wait()
+
+
+def test_sampling_profiler_sees_other_threads():
+    stop = threading.Event()
+    workers = [threading.Thread(target=x, args=(stop,)) for x in (busy_loop, idle_wait, idle_wait)]
+    for worker in workers:
+        worker.start()
+
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    time.sleep(0.2)
+    profiler.stop()
+    stop.set()
+    for worker in workers:
+        worker.join()
+
+    assert not profiler.running
+    assert profiler.samples
+    assert profiler.idle
+    report = profiler.report()
+    assert "idle_wait" not in report
+    # percentages are of ticks, not of samples of all threads
+    line = next(x for x in report.splitlines() if "busy_loop" in x)
+    assert 50 < float(line.split()[1].rstrip("%")) <= 100
+
+
+def test_is_idle():
+    stop = threading.Event()
+    waiter = threading.Thread(target=idle_wait, args=(stop,))
+    waiter.start()
+    time.sleep(0.05)
+    frame = sys._current_frames()[waiter.ident]
+    stop.set()
+    waiter.join()
+    assert is_idle(frame)
+    assert not is_idle(sys._getframe())
+
+
+def test_memory_profiler():
+    profiler = MemoryProfiler()
+    profiler.start()
+    data = [bytearray(1024) for _ in range(1000)]
+    profiler.stop()
+    assert "test_profiler.py" in profiler.report()
+    del data
+
+
+def test_session_report():
+    session = ProfilingSession(cpu=True, memory=False)
+    session.start()
+    report = session.stop()
+    assert report.startswith("Profiled for")
+    assert "ticks every" in report
+
+
+def test_profile_is_admin_only(bot):
+    replies = []
+    update = SimpleNamespace(
+        effective_chat=SimpleNamespace(id=1),
+        message=SimpleNamespace(reply_text=replies.append)
+    )
+    bot.start_profiling(update, SimpleNamespace(args=["1"]))
+    assert bot.profiling is None
+    assert replies == []
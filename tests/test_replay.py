@@ -0,0 +1,74 @@
+from app.bot import Bot
+from app.replay import UpdateRecorder, UpdateFactory, Replayer, load_updates, percentiles, synthesize
+
+
+def test_percentiles():
+    stats = percentiles([x / 100 for x in range(1, 101)])
+    assert stats["p50"] == 0.5
+    assert stats["p99"] == 0.99
+    assert stats["max"] == 1.0
+
+
+def test_recorder_round_trip(tmp_path):
+    path = str(tmp_path / "updates.jsonl.gz")
+    factory = UpdateFactory()
+    recorder = UpdateRecorder(path)
+    recorder.write({"type": "update", "update": factory.message(1, "/start")})
+    recorder.write({"type": "call", "method": "sendMessage", "data": {}, "seconds": 0})
+    recorder.close()
+
+    updates = load_updates(path)
+    assert len(updates) == 1
+    assert updates[0][1]["message"]["text"] == "/start"
+
+
+def test_replay_synthetic():
+    # replayer replaces reddit client, so the session bot isn't used
+    bot = Bot(config_file="../tests/config.yaml")
+    updates = synthesize(users=20, updates=300, seed=1)
+    report = Replayer(bot, reddit_latency=0.01).run(updates, timeout=60)
+    assert report.updates == len(updates)
+    assert report.errors == 0
+    assert report.calls.get("sendPhoto")
+    assert report.handler["p99"] < 1
+    # /show and subscriptions fetch reddit in background, replay waits for them
+    assert report.background["max"] >= 0.01
+    assert report.background_errors == 0
+    assert bot.reddit_executor.pending == 0
+
+
+def test_replay_counts_background_errors():
+    bot = Bot(config_file="../tests/config.yaml")
+    replayer = Replayer(bot)
+
+    def search_by_name(name):
+        raise RuntimeError("reddit is down")
+
+    replayer.reddit.subreddits.search_by_name = search_by_name
+    factory = UpdateFactory()
+    report = replayer.run([(0, factory.message(1, "/show aww 3")), (0, factory.message(2, "/show pics 2 week"))])
+    assert report.updates == 2
+    assert report.background_errors == 2
+    assert report.errors == 2
+    assert "2 in background tasks" in report.format()
+
+
+class Untouchable(object):
+    def __init__(self):
+        self.used = []
+
+    def __getattr__(self, name):
+        self.used.append(name)
+        return lambda *args, **kwargs: None
+
+
+def test_replay_does_not_touch_storage():
+    bot = Bot(config_file="../tests/config.yaml")
+    store, archive = Untouchable(), Untouchable()
+    bot.store = store
+    bot.archive = bot.fetcher.archive = archive
+    factory = UpdateFactory()
+    updates = [(0, factory.message(1, "/sub aww 1 3")), (0, factory.message(2, "/show aww 3"))]
+    report = Replayer(bot).run(updates)
+    assert report.errors == 0
+    assert store.used == [] and archive.used == []
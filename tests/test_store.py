@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+from app.helpers import batched
+from app.store import subscription_upsert
+from app.cluster import partition_of
+
+
+def test_batched():
+    assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(batched([], 2)) == []
+
+
+def test_subscription_upsert():
+    op = subscription_upsert({
+        "chat_id": 1, "subreddit": "aww", "limit": 3, "interval": 3600.0,
+        "created_at": 10.0, "_id": "ignored"
+    })
+    assert op._filter == {"chat_id": 1, "subreddit": "aww"}
+    assert op._doc == {
+        "$set": {"chat_id": 1, "subreddit": "aww", "limit": 3, "interval": 3600.0,
+                 "paused": False, "partition": partition_of(1)},
+        "$setOnInsert": {"created_at": 10.0},
+    }
+    assert op._upsert
+
+
+def test_stored_subscriptions_are_scheduled(bot):
+    docs = [
+        {"chat_id": 11, "subreddit": "aww", "limit": 2, "interval": 600.0, "paused": False},
+        {"chat_id": 12, "subreddit": "pics", "limit": 1, "interval": 3600.0, "paused": True},
+    ]
+    jobs = []
+
+    def run_repeating(callback, **kwargs):
+        jobs.append(SimpleNamespace(callback=callback, enabled=True, **kwargs))
+        return jobs[-1]
+
+    store, reddit = bot.store, bot.reddit
+    bot.store = SimpleNamespace(iter_all=lambda: iter(docs))
+    bot.reddit = SimpleNamespace(subreddit=lambda name: SimpleNamespace(display_name=name))
+    try:
+        bot._load_subscriptions(SimpleNamespace(run_repeating=run_repeating))
+    finally:
+        bot.store, bot.reddit = store, reddit
+
+    assert [(x.name, x.interval, x.enabled) for x in jobs] == [("11", 600.0, True), ("12", 3600.0, False)]
+    assert jobs[0].context['channel'].display_name == "aww"
+    assert "12" in bot.paused_chats
+    assert ("11", "aww") in bot.capacity._subscriptions
+    bot.capacity.load([])
+    bot.paused_chats.discard("12")